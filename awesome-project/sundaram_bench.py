@@ -0,0 +1,147 @@
+from typing import List, Dict
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+from sundaram_sieve import np, resheto_sundarama, resheto_sundarama_naive, resheto_sundarama_segmented, \
+    resheto_sundarama_parallel, count_primes, PrimeTable, SIEVE_WORKERS, shutdown_pool
+
+BENCH_OUTPUT = os.environ.get("SUNDARAM_BENCH_OUTPUT", "sundaram_bench.json")
+BENCH_THRESHOLD = float(os.environ.get("SUNDARAM_BENCH_THRESHOLD", 0.10))
+
+# движок: функция limit -> список простых (или их количество) и наибольший limit, на котором его имеет смысл мерить
+ENGINES = {
+    "naive": (resheto_sundarama_naive, 10 ** 7),
+    "sundaram": (lambda limit: resheto_sundarama(limit, workers=1), 10 ** 8),
+    "segmented": (resheto_sundarama_segmented, 10 ** 8),
+    "parallel": (lambda limit: resheto_sundarama_parallel(limit, SIEVE_WORKERS), 10 ** 8),
+    "incremental": (lambda limit: PrimeTable(max_limit=limit).get(limit), 10 ** 8),
+    "count": (count_primes, 10 ** 8),
+}
+
+def machine_info() -> dict:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__ if np is not None else None,
+    }
+
+def measure(engine: str, limit: int, repeat: int, memory: bool = True) -> dict:
+    func = ENGINES[engine][0]
+    times = []
+    count = 0
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func(limit)
+        times.append(time.perf_counter() - start)
+        count = result if isinstance(result, int) else len(result)
+        del result
+
+    # пиковая память - отдельным прогоном: tracemalloc замедляет код и исказил бы время;
+    # numpy сообщает tracemalloc о своих буферах, память процессов пула не учитывается
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        result = func(limit)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del result
+
+    best = min(times)
+    return {
+        "engine": engine,
+        "limit": limit,
+        "count": count,
+        "wall_time": best,
+        "mean_time": sum(times) / len(times),
+        "peak_memory": peak,
+        "primes_per_sec": count / best if best > 0 else None,
+    }
+
+def run_suite(engines: List[str], limits: List[int], repeat: int = 3, memory: bool = True, verbose: bool = False) -> dict:
+    results = []
+    for engine in engines:
+        for limit in limits:
+            if limit > ENGINES[engine][1]:
+                continue
+            record = measure(engine, limit, repeat, memory)
+            results.append(record)
+            if verbose:
+                print(format_record(record))
+    shutdown_pool()
+    return {"machine": machine_info(), "created_at": time.strftime('%Y-%m-%d %H:%M:%S'), "results": results}
+
+def format_record(record: dict) -> str:
+    memory = f"{record['peak_memory'] / 2 ** 20:9.1f} МБ" if record['peak_memory'] is not None else "        -"
+    speed = f"{record['primes_per_sec']:14,.0f}" if record['primes_per_sec'] else "             -"
+    return (f"{record['engine']:12} {record['limit']:>11} {record['count']:>10} "
+            f"{record['wall_time']:10.4f} с {memory} {speed} простых/с")
+
+def compare(current: dict, baseline: dict, threshold: float = None) -> List[dict]:
+    # регрессия - лучшее время хуже базового больше чем на threshold
+    threshold = BENCH_THRESHOLD if threshold is None else threshold
+    old = {(r["engine"], r["limit"]): r for r in baseline["results"]}
+    rows = []
+    for record in current["results"]:
+        base = old.get((record["engine"], record["limit"]))
+        if base is None or not base["wall_time"]:
+            continue
+        ratio = record["wall_time"] / base["wall_time"]
+        rows.append({"engine": record["engine"], "limit": record["limit"], "baseline": base["wall_time"],
+                     "current": record["wall_time"], "ratio": ratio, "regression": ratio > 1 + threshold})
+    return rows
+
+def save(results: dict, path: str):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    os.replace(tmp_path, path)
+
+def load(path: str) -> Dict:
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк движков решета Сундарама")
+    parser.add_argument("--engines", default="sundaram,segmented,parallel,incremental,count",
+                        help=f"движки через запятую: {', '.join(ENGINES)}")
+    parser.add_argument("--min-exp", type=int, default=3, help="наименьший limit = 10^min-exp")
+    parser.add_argument("--max-exp", type=int, default=8, help="наибольший limit = 10^max-exp")
+    parser.add_argument("--repeat", type=int, default=3, help="число повторов, в отчет идет лучшее время")
+    parser.add_argument("--no-memory", action="store_true", help="не измерять пиковую память")
+    parser.add_argument("-o", "--output", default=BENCH_OUTPUT, help="файл для результатов в JSON")
+    parser.add_argument("--baseline", help="файл с базовыми результатами для сравнения")
+    parser.add_argument("--threshold", type=float, default=BENCH_THRESHOLD, help="допустимое замедление, доля")
+    args = parser.parse_args()
+
+    engines = [engine.strip() for engine in args.engines.split(",") if engine.strip()]
+    unknown = [engine for engine in engines if engine not in ENGINES]
+    if unknown:
+        parser.error(f"неизвестные движки: {', '.join(unknown)}")
+    limits = [10 ** exp for exp in range(args.min_exp, args.max_exp + 1)]
+
+    results = run_suite(engines, limits, args.repeat, not args.no_memory, verbose=True)
+    save(results, args.output)
+    print(f"Результаты записаны в {args.output}")
+
+    if args.baseline:
+        rows = compare(results, load(args.baseline), args.threshold)
+        for row in rows:
+            mark = "РЕГРЕССИЯ" if row["regression"] else "ok"
+            print(f"{row['engine']:12} {row['limit']:>11} {row['baseline']:10.4f} -> {row['current']:10.4f} с "
+                  f"({row['ratio']:.2f}x) {mark}")
+        regressions = [row for row in rows if row["regression"]]
+        if regressions:
+            print(f"Найдено регрессий: {len(regressions)} (порог {args.threshold:.0%})")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,26 @@
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 from pydantic import BaseModel
+import argparse
+import asyncio
+import os
 import re
 import time
 import hashlib
 
+from sundaram_codec import PRIMES_MEDIA_TYPE, decode_primes_payload
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+BASE_URL = os.environ.get("SUNDARAM_URL", "http://localhost:8000")
+CLIENT_TIMEOUT = float(os.environ.get("SUNDARAM_CLIENT_TIMEOUT", 30))
+CLIENT_CONNECT_TIMEOUT = float(os.environ.get("SUNDARAM_CLIENT_CONNECT_TIMEOUT", 5))
+CLIENT_RETRIES = int(os.environ.get("SUNDARAM_CLIENT_RETRIES", 3))
+CLIENT_POOL_SIZE = int(os.environ.get("SUNDARAM_CLIENT_POOL_SIZE", 10))
+JOB_FINISHED = ("done", "failed", "cancelled")
+
 class User(BaseModel):
     login: str
     email: str
@@ -42,30 +58,148 @@ def print_error(response):
     except:
         print(f"Ошибка: {response}")
 
-class Client:
-    def __init__(self):
+def make_session(retries=None, pool_size=None):
+    # одно keep-alive соединение на все запросы; urllib3 повторяет только запросы, оборвавшиеся на соединении.
+    # Ответы 502/503/504 повторяет Client.signed_request: повтор urllib3 отправил бы старые Authorization
+    # и X-Timestamp, и после пауз сервер отвечал бы 401
+    retry = Retry(total=CLIENT_RETRIES if retries is None else retries, backoff_factor=0.2, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size or CLIENT_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+class Signer:
+    # подпись запроса: sha256(session_token + тело + время); общая для синхронного и асинхронного клиентов
+    def __init__(self, base_url=None, timeout=None):
+        self.base_url = (base_url or BASE_URL).rstrip("/")
+        self.timeout = timeout or CLIENT_TIMEOUT
         self.session_token = None
+        self.user_id = None
     
-    def create_signature(self, data):
-        current_time = str(int(time.time()))
+    def url(self, path):
+        return path if path.startswith("http") else f"{self.base_url}{path}"
+    
+    def login(self, user):
+        self.session_token = user['session_token']
+        self.user_id = user.get('user_id')
+    
+    def create_signature(self, data, current_time=None):
+        current_time = current_time or str(int(time.time()))
         body_str = json.dumps(data) if data is not None else "{}"
         signature = hashlib.sha256(f"{self.session_token}{body_str}{current_time}".encode()).hexdigest()
         return signature
     
-    def send_request(self, method, url, data=None):
-        headers = {'Authorization': self.create_signature(data)}
+    def auth_headers(self, data):
+        # id и время подписи позволяют серверу проверить одну подпись вместо перебора всех сессий
+        current_time = str(int(time.time()))
+        headers = {'Authorization': self.create_signature(data, current_time), 'X-Timestamp': current_time}
+        if self.user_id is not None:
+            headers['X-User-Id'] = str(self.user_id)
+        return headers
+
+class Client(Signer):
+    def __init__(self, base_url=None, timeout=None, retries=None, session=None):
+        super().__init__(base_url, timeout)
+        self.retries = CLIENT_RETRIES if retries is None else retries
+        self.session = session or make_session(retries)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def close(self):
+        self.session.close()
+    
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault('timeout', (CLIENT_CONNECT_TIMEOUT, self.timeout))
+        return self.session.request(method.upper(), self.url(path), **kwargs)
+    
+    def signed_request(self, method, path, data=None, accept=None, **kwargs):
+        # подпись пересчитывается на каждую попытку, как в AsyncClient.request. 503 сервер отдает до начала
+        # работы (очередь решета полна), поэтому повторяется и POST; 502/504 - только идемпотентные методы
+        for attempt in range(self.retries + 1):
+            headers = self.auth_headers(data)
+            if accept:
+                headers['Accept'] = accept
+            response = self.request(method, path, json=data, headers=headers, **kwargs)
+            retry = response.status_code == 503 or (
+                response.status_code in (502, 504) and method.upper() in Retry.DEFAULT_ALLOWED_METHODS)
+            if not retry or attempt == self.retries:
+                return response
+            response.close()
+            time.sleep(float(response.headers.get('Retry-After', 0.2 * 2 ** attempt)))
+    
+    def send_request(self, method, url, data=None, accept=None):
+        response = self.signed_request(method, url, data, accept)
         
-        if method.upper() == 'GET':
-            response = requests.get(url, json=data, headers=headers)
-        elif method.upper() == 'POST':
-            response = requests.post(url, json=data, headers=headers)
-        elif method.upper() == 'PATCH':
-            response = requests.patch(url, json=data, headers=headers)
-        elif method.upper() == 'DELETE':
-            response = requests.delete(url, json=data, headers=headers)
+        # бинарный ответ со списком простых сразу декодируется в словарь
+        if response.status_code == 200 and response.headers.get('Content-Type', '').startswith(PRIMES_MEDIA_TYPE):
+            return decode_primes_payload(response.content), response.status_code
         
         return response.text, response.status_code
     
+    def stream_request(self, method, url, data=None):
+        response = self.signed_request(method, url, data, NDJSON_MEDIA_TYPE, stream=True)
+        
+        if response.status_code != 200:
+            return response.text, response.status_code
+        
+        return (json.loads(line) for line in response.iter_lines() if line), response.status_code
+    
+    def iter_primes(self, limit, on_summary=None):
+        records, code = self.stream_request('POST', "/sundaram/generate", {"limit": limit})
+        
+        if code != 200:
+            raise RuntimeError(records)
+        
+        for record in records:
+            if 'primes' in record:
+                yield record['primes']
+            elif on_summary is not None:
+                on_summary(record)
+    
+    def create_job(self, limit):
+        result, code = self.send_request('POST', "/sundaram/jobs", {"limit": limit})
+        if code != 202:
+            raise RuntimeError(result)
+        return json.loads(result)
+    
+    def job_status(self, job_id):
+        result, code = self.send_request('GET', f"/sundaram/jobs/{job_id}")
+        if code != 200:
+            raise RuntimeError(result)
+        return json.loads(result)
+    
+    def job_result(self, job_id):
+        result, code = self.send_request('GET', f"/sundaram/jobs/{job_id}/result",
+                                         accept=PRIMES_MEDIA_TYPE)
+        if code != 200:
+            raise RuntimeError(result)
+        return result
+    
+    def cancel_job(self, job_id):
+        result, code = self.send_request('DELETE', f"/sundaram/jobs/{job_id}")
+        if code != 200:
+            raise RuntimeError(result)
+        return json.loads(result)
+    
+    def wait_job(self, job_id, interval=0.5, timeout=None, on_progress=None):
+        # опрос статуса, пока задача не завершится; интервал растет до 5 секунд
+        deadline = time.time() + timeout if timeout is not None else None
+        while True:
+            status = self.job_status(job_id)
+            if on_progress is not None:
+                on_progress(status)
+            if status['status'] in JOB_FINISHED:
+                return status
+            if deadline is not None and time.time() >= deadline:
+                raise TimeoutError(f"Задача {job_id} не завершилась за {timeout} с")
+            time.sleep(interval)
+            interval = min(interval * 1.5, 5.0)
+    
     def print_sundaram_requirements(self):
         print("\n")
         print("ГЕНЕРАЦИЯ ПРОСТЫХ ЧИСЕЛ МЕТОДОМ РЕШЕТА СУНДАРАМА")
@@ -102,11 +236,11 @@ class Client:
         print("Пароли совпадают")
         user_data = User(login=login, email=email, password=password)
         
-        response = requests.post("http://localhost:8000/users/register", json=user_data.model_dump())
+        response = self.request('POST', "/users/register", json=user_data.model_dump())
         
         if response.status_code == 200:
             user = response.json()
-            self.session_token = user['session_token']
+            self.login(user)
             print(f"\nПользователь {user['login']} успешно зарегистрирован!")
             return True
         else:
@@ -122,11 +256,11 @@ class Client:
         
         user_data = AuthUser(login=login, password=password)
         
-        response = requests.post("http://localhost:8000/users/authenticate", json=user_data.model_dump())
+        response = self.request('POST', "/users/authenticate", json=user_data.model_dump())
         
         if response.status_code == 200:
             user = response.json()
-            self.session_token = user['session_token']
+            self.login(user)
             print(f"\nАвторизация {user['login']} прошла успешно!")
             return True
         else:
@@ -145,29 +279,63 @@ class Client:
                 print("Ошибка: верхняя граница должна быть положительным числом!")
                 return
             
-            data = {"limit": limit}
-            result, code = self.send_request('POST', "http://localhost:8000/sundaram/generate", data)
+            summary = {}
+            row = []
+            for chunk in self.iter_primes(limit, summary.update):
+                row.extend(chunk)
+                while len(row) >= 10:
+                    print(" ".join(str(x) for x in row[:10]))
+                    del row[:10]
+            if row:
+                print(" ".join(str(x) for x in row))
             
-            if code == 200:
-                response_data = json.loads(result)
-                print(f"\n{response_data['message']}")
-                primes = response_data['primes']
-                print(f"Найдено {len(primes)} простых чисел до {limit}:")
-                
-                for i in range(0, len(primes), 10):
-                    print(" ".join(str(x) for x in primes[i:i+10]))
-            else:
-                print_error(result)
+            if summary:
+                print(f"\n{summary['message']}")
+        except RuntimeError as e:
+            print_error(str(e))
+        except ValueError:
+            print("Ошибка: введите целое число")
+        except Exception as e:
+            print(f"Произошла ошибка: {e}")
+    
+    def run_job(self):
+        print("\nФОНОВАЯ ГЕНЕРАЦИЯ ПРОСТЫХ ЧИСЕЛ")
+        
+        try:
+            limit = int(input("Верхняя граница (n) для поиска простых чисел: "))
+            
+            if limit < 1:
+                print("Ошибка: верхняя граница должна быть положительным числом!")
+                return
+            
+            job = self.create_job(limit)
+            print(f"Задача {job['job_id']} создана")
+            
+            status = self.wait_job(job['job_id'],
+                                   on_progress=lambda s: print(f"  {s['status']}: {s['progress'] * 100:.0f}%"))
+            if status['status'] != "done":
+                print(f"Задача завершилась со статусом {status['status']}: {status.get('error') or ''}")
+                return
+            
+            response_data = self.job_result(job['job_id'])
+            print(f"\n{response_data['message']}")
+            primes = response_data['primes']
+            for i in range(0, min(len(primes), 100), 10):
+                print(" ".join(str(x) for x in primes[i:i+10]))
+            if len(primes) > 100:
+                print("...")
+        except RuntimeError as e:
+            print_error(str(e))
         except ValueError:
             print("Ошибка: введите целое число")
         except Exception as e:
             print(f"Произошла ошибка: {e}")
     
     def get_current_result(self):
-        result, code = self.send_request('GET', "http://localhost:8000/sundaram/current")
+        result, code = self.send_request('GET', "/sundaram/current", accept=PRIMES_MEDIA_TYPE)
         
         if code == 200:
-            response_data = json.loads(result)
+            response_data = result
             print(f"\n{response_data['message']}")
             
             if 'limit' in response_data:
@@ -179,13 +347,62 @@ class Client:
         else:
             print_error(result)
     
+    def find_primes_range(self):
+        print("\nПОИСК ПРОСТЫХ ЧИСЕЛ В ДИАПАЗОНЕ")
+        
+        try:
+            lo = int(input("Нижняя граница: "))
+            hi = int(input("Верхняя граница: "))
+            
+            if lo < 0 or hi < lo:
+                print("Ошибка: границы должны удовлетворять условию 0 <= нижняя <= верхняя!")
+                return
+            
+            result, code = self.send_request('GET', f"/sundaram/range?lo={lo}&hi={hi}")
+            
+            if code == 200:
+                response_data = json.loads(result)
+                print(f"\n{response_data['message']}")
+                primes = response_data['primes']
+                
+                for i in range(0, len(primes), 10):
+                    print(" ".join(str(x) for x in primes[i:i+10]))
+            else:
+                print_error(result)
+        except ValueError:
+            print("Ошибка: введите целое число")
+        except Exception as e:
+            print(f"Произошла ошибка: {e}")
+    
+    def count_primes(self):
+        print("\nПОДСЧЕТ КОЛИЧЕСТВА ПРОСТЫХ ЧИСЕЛ")
+        
+        try:
+            limit = int(input("Верхняя граница (n): "))
+            
+            if limit < 1:
+                print("Ошибка: верхняя граница должна быть положительным числом!")
+                return
+            
+            result, code = self.send_request('GET', f"/sundaram/count?limit={limit}")
+            
+            if code == 200:
+                response_data = json.loads(result)
+                print(f"\n{response_data['message']}")
+            else:
+                print_error(result)
+        except ValueError:
+            print("Ошибка: введите целое число")
+        except Exception as e:
+            print(f"Произошла ошибка: {e}")
+    
     def delete_current_result(self):
         confirm = input("\nВы уверены, что хотите удалить текущий результат? (да/нет): ")
         if confirm.lower() != 'да':
             print("Отмена...")
             return
         
-        result, code = self.send_request('DELETE', "http://localhost:8000/sundaram/current")
+        result, code = self.send_request('DELETE', "/sundaram/current")
         
         if code == 200:
             response_data = json.loads(result)
@@ -209,7 +426,7 @@ class Client:
                 return
             
             data = {"name": name, "limit": limit}
-            result, code = self.send_request('POST', "http://localhost:8000/sundaram/save_params", data)
+            result, code = self.send_request('POST', "/sundaram/save_params", data)
             
             if code == 200:
                 response_data = json.loads(result)
@@ -224,7 +441,7 @@ class Client:
             print(f"Произошла ошибка: {e}")
     
     def show_saved_parameters(self):
-        result, code = self.send_request('GET', "http://localhost:8000/sundaram/saved_params")
+        result, code = self.send_request('GET', "/sundaram/saved_params")
         
         if code == 200:
             response_data = json.loads(result)
@@ -252,7 +469,7 @@ class Client:
             print("Отмена операции!")
             return
         
-        result, code = self.send_request('DELETE', f"http://localhost:8000/sundaram/saved_params/{param_name}")
+        result, code = self.send_request('DELETE', f"/sundaram/saved_params/{param_name}")
         
         if code == 200:
             response_data = json.loads(result)
@@ -263,20 +480,25 @@ class Client:
             print_error(result)
     
     def view_history(self):
-        result, code = self.send_request('GET', "http://localhost:8000/users/history")
+        history = []
+        cursor = 0
         
-        if code == 200:
-            response_data = json.loads(result)
-            print(f"\n{response_data['message']}")
+        # история отдается страницами, пока сервер возвращает next_cursor
+        while cursor is not None:
+            result, code = self.send_request('GET', f"/users/history?cursor={cursor}")
             
-            history = response_data['history']
-            if not history:
-                print("История пуста")
-            else:
-                for i, inf in enumerate(history, 1):
-                    print(f"{i}. {inf.get('time')}: {inf.get('operation')} ({inf.get('details')})")
-        else:
-            print_error(result)
+            if code != 200:
+                print_error(result)
+                return
+            
+            response_data = json.loads(result)
+            history.extend(response_data['history'])
+            cursor = response_data.get('next_cursor')
+        
+        print(f"\n{response_data['message'] if history else 'История пуста'}")
+        
+        for i, inf in enumerate(history, 1):
+            print(f"{i}. {inf.get('time')}: {inf.get('operation')} ({inf.get('details')})")
     
     def delete_history(self):
         confirm = input("\nВы точно хотите удалить всю историю запросов? (да/нет): ")
@@ -284,7 +506,7 @@ class Client:
             print("Отмена операции")
             return
         
-        result, code = self.send_request('DELETE', "http://localhost:8000/users/history")
+        result, code = self.send_request('DELETE', "/users/history")
         
         if code == 200:
             response_data = json.loads(result)
@@ -312,7 +534,7 @@ class Client:
             return
         
         data = {"old_password": old_password, "new_password": new_password}
-        result, code = self.send_request('PATCH', "http://localhost:8000/users/password", data)
+        result, code = self.send_request('PATCH', "/users/password", data)
         
         if code == 200:
             response_data = json.loads(result)
@@ -330,10 +552,13 @@ class Client:
             print("4. Показать сохраненные параметры")
             print("5. Удалить сохраненные параметры")
             print("6. Удалить текущий результат")
-            print("7. Назад в главное меню")
+            print("7. Найти простые числа в диапазоне")
+            print("8. Посчитать количество простых чисел")
+            print("9. Фоновая генерация с ожиданием результата")
+            print("10. Назад в главное меню")
         
             try:
-                choice = input("Выберите действие (1-9): ").strip()
+                choice = input("Выберите действие (1-10): ").strip()
                 
                 if choice == "1":
                     self.generate_primes()
@@ -348,10 +573,16 @@ class Client:
                 elif choice == "6":
                     self.delete_current_result()
                 elif choice == "7":
+                    self.find_primes_range()
+                elif choice == "8":
+                    self.count_primes()
+                elif choice == "9":
+                    self.run_job()
+                elif choice == "10":
                     print("Возврат в главное меню.")
                     return
                 else:
-                    print("Неверный выбор. Введите число от 1 до 9")
+                    print("Неверный выбор. Введите число от 1 до 10")
             except Exception as e:
                 print(f"Произошла ошибка: {e}")
     
@@ -397,14 +628,103 @@ class Client:
                 elif choice == "3":
                     print("Выход из профиля выполнен")
                     self.session_token = None
+                    self.user_id = None
                     break
                 else:
                     print("Неверный выбор. Введите число от 1 до 3")
             except Exception as e:
                 print(f"Произошла ошибка: {e}")
 
+class AsyncClient(Signer):
+    # много подписанных запросов одновременно поверх одного пула keep-alive соединений
+    def __init__(self, base_url=None, timeout=None, retries=None, concurrency=None, http=None):
+        super().__init__(base_url, timeout)
+        self.retries = CLIENT_RETRIES if retries is None else retries
+        self.concurrency = concurrency or CLIENT_POOL_SIZE
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        self.http = http or httpx.AsyncClient(
+            base_url=self.base_url, limits=limits,
+            timeout=httpx.Timeout(self.timeout, connect=CLIENT_CONNECT_TIMEOUT),
+            transport=httpx.AsyncHTTPTransport(retries=self.retries, limits=limits))
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc):
+        await self.close()
+    
+    async def close(self):
+        await self.http.aclose()
+    
+    async def request(self, method, path, data=None, accept=None, signed=True):
+        # 503 от перегруженного сервера повторяется после Retry-After; подпись пересчитывается на каждую попытку,
+        # чтобы не устареть
+        for attempt in range(self.retries + 1):
+            headers = self.auth_headers(data) if signed else {}
+            if accept:
+                headers['Accept'] = accept
+            response = await self.http.request(method.upper(), path, json=data, headers=headers)
+            if response.status_code != 503 or attempt == self.retries:
+                return response
+            await asyncio.sleep(float(response.headers.get('Retry-After', 0.2 * 2 ** attempt)))
+    
+    async def send_request(self, method, url, data=None, accept=None):
+        response = await self.request(method, url, data, accept)
+        if response.status_code == 200 and response.headers.get('Content-Type', '').startswith(PRIMES_MEDIA_TYPE):
+            return decode_primes_payload(response.content), response.status_code
+        return response.text, response.status_code
+    
+    async def register(self, login, email, password):
+        response = await self.request('POST', "/users/register",
+                                      User(login=login, email=email, password=password).model_dump(), signed=False)
+        if response.status_code != 200:
+            raise RuntimeError(response.text)
+        self.login(response.json())
+        return response.json()
+    
+    async def authenticate(self, login, password):
+        response = await self.request('POST', "/users/authenticate",
+                                      AuthUser(login=login, password=password).model_dump(), signed=False)
+        if response.status_code != 200:
+            raise RuntimeError(response.text)
+        self.login(response.json())
+        return response.json()
+    
+    async def generate(self, limit):
+        result, code = await self.send_request('POST', "/sundaram/generate", {"limit": limit},
+                                               accept=PRIMES_MEDIA_TYPE)
+        if code != 200:
+            raise RuntimeError(result)
+        return result if isinstance(result, dict) else json.loads(result)
+    
+    async def count(self, limit):
+        result, code = await self.send_request('GET', f"/sundaram/count?limit={limit}")
+        if code != 200:
+            raise RuntimeError(result)
+        return json.loads(result)
+    
+    async def gather(self, calls, concurrency=None):
+        # не больше concurrency запросов в полете; результаты - в порядке вызовов
+        semaphore = asyncio.Semaphore(concurrency or self.concurrency)
+        
+        async def limited(call):
+            async with semaphore:
+                return await call
+        
+        return await asyncio.gather(*[limited(call) for call in calls])
+    
+    async def generate_many(self, limits, concurrency=None):
+        return await self.gather([self.generate(limit) for limit in limits], concurrency)
+    
+    async def count_many(self, limits, concurrency=None):
+        return await self.gather([self.count(limit) for limit in limits], concurrency)
+
 def main():
-    client = Client()
+    parser = argparse.ArgumentParser(description="Клиент системы генерации простых чисел")
+    parser.add_argument("--url", default=BASE_URL, help="адрес сервера")
+    args = parser.parse_args()
+    
+    client = Client(args.url)
     
     print("\nСИСТЕМА ГЕНЕРАЦИИ ПРОСТЫХ ЧИСЕЛ - РЕШЕТО СУНДАРАМА")
     
@@ -425,6 +745,7 @@ def main():
                     client.main_menu()
             elif choice == "3":
                 print("\nПрограмма завершена.")
+                client.close()
                 break
             else:
                 print("Неверный выбор. Введите число от 1 до 3")
@@ -0,0 +1,124 @@
+from typing import List
+from array import array
+import json
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Формат ответа application/vnd.sundaram.primes:
+#   varint(длина JSON) + JSON с полями ответа без "primes"
+#   varint(количество простых) + varint-разности соседних простых (первая разность - от нуля)
+PRIMES_MEDIA_TYPE = "application/vnd.sundaram.primes"
+
+def write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+def read_varint(data, pos: int):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+def encode_gaps(primes: List[int], previous: int = 0) -> bytes:
+    # previous - простое перед первым из primes: так список кодируется по частям
+    if np is None:
+        out = bytearray()
+        for prime in primes:
+            write_varint(out, prime - previous)
+            previous = prime
+        return bytes(out)
+
+    gaps = np.diff(np.asarray(primes, dtype=np.uint64), prepend=np.uint64(previous))
+    lengths = np.ones(len(gaps), dtype=np.int64)
+    rest = gaps >> np.uint64(7)
+    while rest.any():
+        lengths += rest > 0
+        rest >>= np.uint64(7)
+
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    out = np.empty(int(ends[-1]) if len(ends) else 0, dtype=np.uint8)
+    for b in range(int(lengths.max()) if len(lengths) else 0):
+        mask = lengths > b
+        byte = (gaps[mask] >> np.uint64(7 * b)) & np.uint64(0x7f)
+        byte |= np.where(lengths[mask] > b + 1, np.uint64(0x80), np.uint64(0))
+        out[starts[mask] + b] = byte
+    return out.tobytes()
+
+def decode_gaps(data, count: int) -> List[int]:
+    if np is None:
+        primes = []
+        pos = 0
+        previous = 0
+        for _ in range(count):
+            gap, pos = read_varint(data, pos)
+            previous += gap
+            primes.append(previous)
+        return primes
+    return _decode_gaps(data, count).tolist()
+
+def decode_gaps_array(data, count: int) -> array:
+    if np is None:
+        return array('q', decode_gaps(data, count))
+    return array('q', _decode_gaps(data, count).astype(np.int64).tobytes())
+
+def _decode_gaps(data, count: int):
+    raw = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(raw < 0x80)[:count]
+    starts = np.concatenate(([0], ends[:-1] + 1)) if count else ends
+    lengths = ends - starts + 1
+    gaps = np.zeros(len(ends), dtype=np.uint64)
+    for b in range(int(lengths.max()) if count else 0):
+        mask = lengths > b
+        gaps[mask] |= (raw[starts[mask] + b].astype(np.uint64) & np.uint64(0x7f)) << np.uint64(7 * b)
+    return np.cumsum(gaps)
+
+def encode_primes_payload(payload: dict) -> bytes:
+    primes = payload.get("primes", [])
+    meta = json.dumps({key: value for key, value in payload.items() if key != "primes"}).encode()
+
+    out = bytearray()
+    write_varint(out, len(meta))
+    out += meta
+    write_varint(out, len(primes))
+    out += encode_gaps(primes)
+    return bytes(out)
+
+def encode_payload_head(payload: dict, binary: bool) -> bytes:
+    # начало ответа до списка простых; сам список дописывается кусками encode_primes_slice,
+    # в JSON ответ закрывает PAYLOAD_JSON_TAIL
+    meta = {key: value for key, value in payload.items() if key != "primes"}
+    if binary:
+        out = bytearray()
+        data = json.dumps(meta).encode()
+        write_varint(out, len(data))
+        out += data
+        write_varint(out, len(payload["primes"]))
+        return bytes(out)
+    return (json.dumps(meta, ensure_ascii=False, separators=(",", ":"))[:-1] + ',"primes":[').encode()
+
+PAYLOAD_JSON_TAIL = b"]}"
+
+def encode_primes_slice(primes, lo: int, hi: int, binary: bool) -> bytes:
+    if binary:
+        return encode_gaps(primes[lo:hi], primes[lo - 1] if lo else 0)
+    chunk = primes[lo:hi]
+    text = json.dumps(chunk.tolist() if isinstance(chunk, array) else chunk, separators=(",", ":"))[1:-1]
+    return (("," if lo and text else "") + text).encode()
+
+def decode_primes_payload(data: bytes) -> dict:
+    size, pos = read_varint(data, 0)
+    payload = json.loads(data[pos:pos + size])
+    count, pos = read_varint(data, pos + size)
+    payload["primes"] = decode_gaps(memoryview(data)[pos:], count)
+    return payload
@@ -0,0 +1,137 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from bisect import bisect_right
+from contextlib import asynccontextmanager
+import asyncio
+import functools
+import multiprocessing
+import os
+import threading
+
+from sundaram_profile import current_profile
+
+# SIEVE_PROCESSES = 0 - решето считается в потоках сервера (без отдельных процессов)
+SIEVE_PROCESSES = int(os.environ.get("SUNDARAM_SIEVE_PROCESSES", 1))
+IO_THREADS = int(os.environ.get("SUNDARAM_IO_THREADS", 16))
+HEAVY_CONCURRENCY = int(os.environ.get("SUNDARAM_HEAVY_CONCURRENCY", 2))
+HEAVY_QUEUE_LIMIT = int(os.environ.get("SUNDARAM_HEAVY_QUEUE_LIMIT", 32))
+
+class Overloaded(Exception):
+    pass
+
+class Executors:
+    # тяжелые задачи (решето) - в пуле процессов, не больше concurrency одновременно и queue_limit в ожидании;
+    # блокирующий ввод-вывод (файлы, SQLite) - в пуле потоков, чтобы не останавливать цикл событий
+    def __init__(self, processes: int = None, threads: int = None, concurrency: int = None, queue_limit: int = None):
+        self.processes = SIEVE_PROCESSES if processes is None else processes
+        self.threads = threads or IO_THREADS
+        self.concurrency = concurrency or HEAVY_CONCURRENCY
+        self.queue_limit = HEAVY_QUEUE_LIMIT if queue_limit is None else queue_limit
+        self.active = 0
+        self.waiting = 0
+        self._semaphore = None
+        self._process_pool = None
+        self._thread_pool = None
+        self._lock = threading.Lock()
+
+    def process_pool(self):
+        with self._lock:
+            if self._process_pool is None:
+                if self.processes > 0:
+                    # spawn: процесс пула не наследует потоки и блокировки сервера
+                    self._process_pool = ProcessPoolExecutor(max_workers=self.processes,
+                                                             mp_context=multiprocessing.get_context("spawn"))
+                else:
+                    self._process_pool = ThreadPoolExecutor(max_workers=self.concurrency,
+                                                            thread_name_prefix="sundaram-sieve")
+            return self._process_pool
+
+    def thread_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="sundaram-io")
+            return self._thread_pool
+
+    async def run_io(self, func, *args, **kwargs):
+        call = functools.partial(func, *args, **kwargs)
+        profile = current_profile.get()
+        if profile is not None:
+            call = profile.wrap(call)
+        return await asyncio.get_running_loop().run_in_executor(self.thread_pool(), call)
+
+    def overloaded(self) -> bool:
+        return self._semaphore is not None and self._semaphore.locked() and self.waiting >= self.queue_limit
+
+    @asynccontextmanager
+    async def heavy_slot(self, reject: bool = True):
+        # обратное давление: при переполненной очереди запрос сразу отклоняется
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        if reject and self.overloaded():
+            raise Overloaded()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    async def run_sieve_unlimited(self, func, *args):
+        call = functools.partial(func, *args)
+        profile = current_profile.get()
+        if profile is not None and self.processes == 0:
+            # процесс пула профилировщику не виден; для разбора решета нужен SUNDARAM_SIEVE_PROCESSES=0
+            call = profile.wrap(call)
+        return await asyncio.get_running_loop().run_in_executor(self.process_pool(), call)
+
+    async def run_sieve(self, func, *args):
+        async with self.heavy_slot():
+            return await self.run_sieve_unlimited(func, *args)
+
+    def shutdown(self):
+        with self._lock:
+            pools = [self._process_pool, self._thread_pool]
+            self._process_pool = None
+            self._thread_pool = None
+        for pool in pools:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+class SingleFlight:
+    # одновременные запросы, чей limit покрыт уже идущим вычислением, ждут его и берут срез результата;
+    # вычисление живет отдельной задачей, поэтому разрыв соединения первого клиента не отменяет его для остальных
+    def __init__(self, offload=None):
+        # offload(func, *args) - где копировать срез для ожидающих запросов; по умолчанию прямо в цикле событий
+        self.offload = offload
+        self.flights = {}
+        self.started = 0
+        self.shared = 0
+
+    async def run(self, limit: int, compute):
+        covering = [flight_limit for flight_limit in self.flights if flight_limit >= limit]
+        if covering:
+            self.shared += 1
+            primes = await asyncio.shield(self.flights[min(covering)])
+            end = bisect_right(primes, limit)
+            if end == len(primes):
+                return primes
+            if self.offload is not None:
+                return await self.offload(primes.__getitem__, slice(0, end))
+            return primes[:end]
+
+        self.started += 1
+        task = asyncio.ensure_future(compute(limit))
+        self.flights[limit] = task
+        task.add_done_callback(lambda done: self._land(limit, done))
+        return await asyncio.shield(task)
+
+    def _land(self, limit: int, task):
+        self.flights.pop(limit, None)
+        if not task.cancelled():
+            task.exception()
+
+executors = Executors()
@@ -0,0 +1,185 @@
+from typing import Union
+from array import array
+import asyncio
+import os
+import time
+import uuid
+
+from sundaram_sieve import table_memory
+
+JOB_TTL = float(os.environ.get("SUNDARAM_JOB_TTL", 600))
+# задач одного пользователя вместе с хранимыми результатами завершенных
+JOBS_PER_USER = int(os.environ.get("SUNDARAM_JOBS_PER_USER", 4))
+# память под результаты всех задач; сверх нее удаляются самые старые завершенные
+JOB_RESULTS_MAX_BYTES = int(os.environ.get("SUNDARAM_JOB_RESULTS_MAX_BYTES", 256 << 20))
+# своя очередь задач: одновременно считаются JOB_CONCURRENCY, ждут не больше JOB_QUEUE_LIMIT
+JOB_CONCURRENCY = int(os.environ.get("SUNDARAM_JOB_CONCURRENCY", 1))
+JOB_QUEUE_LIMIT = int(os.environ.get("SUNDARAM_JOB_QUEUE_LIMIT", 64))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+class TooManyJobs(Exception):
+    pass
+
+class JobTooLarge(Exception):
+    pass
+
+class Job:
+    def __init__(self, user_id: int, limit: int):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.limit = limit
+        # оценка сверху размера результата: под нее место резервируется до запуска
+        self.estimate = table_memory(limit)
+        self.status = QUEUED
+        self.progress = 0.0
+        self.primes = array('q')
+        self.count = 0
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.task = None
+
+    def add(self, chunk, done: int):
+        self.primes.extend(chunk)
+        self.count = len(self.primes)
+        self.progress = min(1.0, done / self.limit) if self.limit else 1.0
+
+    def finish(self, status: str, error: str = None):
+        self.status = status
+        self.error = error
+        self.finished_at = time.time()
+        if status != DONE:
+            self.primes = array('q')
+
+    def nbytes(self) -> int:
+        return len(self.primes) * self.primes.itemsize
+
+    def reserved(self) -> int:
+        return self.nbytes() if self.status in FINISHED else max(self.estimate, self.nbytes())
+
+    def expired(self, now: float, ttl: float) -> bool:
+        return self.finished_at is not None and now - self.finished_at > ttl
+
+    def info(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "progress": round(self.progress, 4),
+            "limit": self.limit,
+            "count": self.count,
+            "error": self.error,
+            "created_at": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.created_at))
+        }
+
+class JobManager:
+    # задачи живут в памяти процесса; завершенные удаляются через ttl секунд, а раньше - при нехватке места:
+    # у пользователя не больше per_user задач, у всех вместе результаты не больше max_bytes.
+    # Незавершенная задача занимает оценку своего результата (table_memory) с момента создания,
+    # поэтому задача, которая не поместится, отклоняется сразу, а не растет в памяти до конца
+    # Задачи считаются в своей очереди и не занимают слоты и очередь тяжелых задач /sundaram/generate
+    def __init__(self, run, on_done=None, ttl: float = None, per_user: int = None, max_bytes: int = None,
+                 concurrency: int = None, queue_limit: int = None):
+        self.run = run
+        self.on_done = on_done
+        self.ttl = JOB_TTL if ttl is None else ttl
+        self.per_user = per_user or JOBS_PER_USER
+        self.max_bytes = JOB_RESULTS_MAX_BYTES if max_bytes is None else max_bytes
+        self.concurrency = concurrency or JOB_CONCURRENCY
+        self.queue_limit = queue_limit or JOB_QUEUE_LIMIT
+        self.jobs = {}
+        self._semaphore = None
+
+    def expire(self):
+        now = time.time()
+        for job_id in [job.id for job in self.jobs.values() if job.expired(now, self.ttl)]:
+            del self.jobs[job_id]
+
+    def _finished(self, jobs) -> list:
+        return sorted((job for job in jobs if job.status in FINISHED), key=lambda job: job.finished_at)
+
+    def make_room(self, user_id: int):
+        # место под новую задачу пользователя: удаляются его самые старые завершенные задачи
+        own = [job for job in self.jobs.values() if job.user_id == user_id]
+        for job in self._finished(own)[:max(0, len(own) - self.per_user + 1)]:
+            del self.jobs[job.id]
+
+    def retained_bytes(self) -> int:
+        return sum(job.reserved() for job in self.jobs.values())
+
+    def trim(self, keep: Job = None, reserve: int = 0):
+        total = self.retained_bytes() + reserve
+        for job in self._finished(self.jobs.values()):
+            if total <= self.max_bytes:
+                break
+            if job is not keep:
+                total -= job.nbytes()
+                del self.jobs[job.id]
+
+    def submit(self, user_id: int, limit: int) -> Job:
+        job = Job(user_id, limit)
+        if job.estimate > self.max_bytes:
+            raise JobTooLarge()
+
+        self.expire()
+        active = [job for job in self.jobs.values() if job.status not in FINISHED]
+        if len(active) >= self.queue_limit or sum(job.user_id == user_id for job in active) >= self.per_user:
+            raise TooManyJobs()
+        if job.estimate + sum(other.reserved() for other in active) > self.max_bytes:
+            raise TooManyJobs()
+        self.make_room(user_id)
+        self.trim(reserve=job.estimate)
+
+        self.jobs[job.id] = job
+        job.task = asyncio.get_running_loop().create_task(self._execute(job))
+        return job
+
+    async def _execute(self, job: Job):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        try:
+            async with self._semaphore:
+                await self.run(job)
+        except asyncio.CancelledError:
+            if job.status not in FINISHED:
+                job.finish(CANCELLED)
+            return
+        except Exception as e:
+            job.finish(FAILED, str(e))
+            return
+
+        job.progress = 1.0
+        job.finish(DONE)
+        if self.on_done is not None:
+            try:
+                await self.on_done(job)
+            except Exception as e:
+                print(f"Ошибка сохранения результата задачи {job.id}: {e}")
+        self.expire()
+        self.trim(keep=job)
+
+    def get(self, user_id: int, job_id: str) -> Union[Job, None]:
+        # чужие задачи не видны: для другого пользователя задачи как будто нет
+        self.expire()
+        job = self.jobs.get(job_id)
+        if job is None or job.user_id != user_id:
+            return None
+        return job
+
+    def cancel(self, job: Job) -> bool:
+        # задача, еще не начавшая работу, отменяется без запуска, поэтому статус ставится сразу
+        if job.status in FINISHED:
+            return False
+        job.task.cancel()
+        job.finish(CANCELLED)
+        return True
+
+    def shutdown(self):
+        for job in self.jobs.values():
+            if job.task is not None and not job.task.done():
+                job.task.cancel()
@@ -0,0 +1,175 @@
+from typing import List, Dict
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+import httpx
+
+from sundaram_client import Signer
+
+# распределение limit для генерации: большинство запросов небольшие, редкие - тяжелые
+LOAD_LIMITS = os.environ.get("SUNDARAM_LOAD_LIMITS", "100:40,10000:30,100000:20,1000000:9,10000000:1")
+# доли операций после регистрации и авторизации
+LOAD_MIX = os.environ.get("SUNDARAM_LOAD_MIX", "generate:40,current:30,history:20,count:10")
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    weights = {}
+    for item in spec.split(","):
+        key, _, weight = item.partition(":")
+        weights[key.strip()] = float(weight or 1)
+    return weights
+
+def percentile(values: List[float], p: float) -> float:
+    # по ближайшему рангу; values отсортированы
+    if not values:
+        return 0.0
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
+
+class LoadStats:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def record(self, endpoint: str, latency: float, ok: bool):
+        self.latencies.setdefault(endpoint, []).append(latency)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def report(self) -> dict:
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        endpoints = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            endpoints[endpoint] = {
+                "requests": len(values),
+                "errors": self.errors.get(endpoint, 0),
+                "throughput": len(values) / elapsed if elapsed else 0,
+                "p50_ms": percentile(values, 50) * 1000,
+                "p95_ms": percentile(values, 95) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+            }
+        total = sum(len(values) for values in self.latencies.values())
+        return {"elapsed": elapsed, "requests": total, "errors": sum(self.errors.values()),
+                "throughput": total / elapsed if elapsed else 0, "endpoints": endpoints}
+
+class VirtualUser:
+    # подпись запросов - та же схема, что у интерактивного клиента (Signer.create_signature)
+    def __init__(self, http: httpx.AsyncClient, stats: LoadStats, name: str, rng: random.Random):
+        self.http = http
+        self.stats = stats
+        self.name = name
+        self.rng = rng
+        self.client = Signer()
+
+    async def call(self, endpoint: str, method: str, url: str, data=None, signed: bool = True, expected=()):
+        headers = self.client.auth_headers(data) if signed else {}
+        start = time.perf_counter()
+        try:
+            response = await self.http.request(method, url, json=data, headers=headers)
+            ok = response.status_code < 400 or response.status_code in expected
+        except httpx.HTTPError:
+            response = None
+            ok = False
+        self.stats.record(endpoint, time.perf_counter() - start, ok)
+        return response if ok else None
+
+    async def run(self, requests_count: int, limits: Dict[str, float], mix: Dict[str, float]):
+        user = {"login": self.name, "email": f"{self.name}@load.test", "password": "Load123!@#"}
+        if await self.call("register", "POST", "/users/register", user, signed=False) is None:
+            return
+        response = await self.call("authenticate", "POST", "/users/authenticate",
+                                   {"login": user["login"], "password": user["password"]}, signed=False)
+        if response is None:
+            return
+        self.client.session_token = response.json()["session_token"]
+        self.client.user_id = response.json().get("user_id")
+
+        limit_values = [int(limit) for limit in limits]
+        operations = list(mix)
+        for _ in range(requests_count):
+            operation = self.rng.choices(operations, weights=list(mix.values()))[0]
+            if operation == "generate":
+                limit = self.rng.choices(limit_values, weights=list(limits.values()))[0]
+                await self.call("generate", "POST", "/sundaram/generate", {"limit": limit})
+            elif operation == "current":
+                # 404 - пользователь еще ничего не сгенерировал, это не ошибка сервера
+                await self.call("current", "GET", "/sundaram/current", expected=(404,))
+            elif operation == "history":
+                await self.call("history", "GET", "/users/history?limit=100")
+            elif operation == "count":
+                limit = self.rng.choices(limit_values, weights=list(limits.values()))[0]
+                await self.call("count", "GET", f"/sundaram/count?limit={limit}")
+
+async def run_load(http: httpx.AsyncClient, users: int, requests_count: int, concurrency: int,
+                   limits: Dict[str, float], mix: Dict[str, float], seed: int = None) -> dict:
+    stats = LoadStats()
+    run_id = time.time_ns()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def session(index: int):
+        async with semaphore:
+            rng = random.Random(None if seed is None else seed + index)
+            await VirtualUser(http, stats, f"load_{run_id}_{index}", rng).run(requests_count, limits, mix)
+
+    await asyncio.gather(*[session(index) for index in range(users)])
+    stats.finished = time.perf_counter()
+    return stats.report()
+
+async def run_in_process(**kwargs) -> dict:
+    # сервер импортируется здесь, чтобы SUNDARAM_DATA_DIR успел указать на временный каталог
+    from sundaram_server import app
+    async with app.router.lifespan_context(app):
+        # ошибки приложения засчитываются как ответы 500, а не прерывают прогон
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://sundaram", timeout=None) as http:
+            return await run_load(http, **kwargs)
+
+async def run_remote(url: str, **kwargs) -> dict:
+    limits = httpx.Limits(max_connections=kwargs["concurrency"], max_keepalive_connections=kwargs["concurrency"])
+    async with httpx.AsyncClient(base_url=url, timeout=None, limits=limits) as http:
+        return await run_load(http, **kwargs)
+
+def print_report(report: dict):
+    print(f"Запросов: {report['requests']}, ошибок: {report['errors']}, время: {report['elapsed']:.2f} с, "
+          f"пропускная способность: {report['throughput']:.1f} запросов/с")
+    print(f"{'операция':14} {'запросов':>9} {'ошибок':>7} {'запр/с':>8} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9}")
+    for endpoint, row in report["endpoints"].items():
+        print(f"{endpoint:14} {row['requests']:>9} {row['errors']:>7} {row['throughput']:>8.1f} "
+              f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочное тестирование sundaram_server")
+    parser.add_argument("--url", help="адрес запущенного сервера; без него приложение запускается в этом процессе")
+    parser.add_argument("--data-dir", help="каталог данных для сервера в процессе (по умолчанию временный)")
+    parser.add_argument("--users", type=int, default=50, help="число виртуальных пользователей")
+    parser.add_argument("--requests", type=int, default=20, help="запросов на пользователя после авторизации")
+    parser.add_argument("--concurrency", type=int, default=50, help="одновременно работающих пользователей")
+    parser.add_argument("--limits", default=LOAD_LIMITS, help="распределение limit, limit:вес через запятую")
+    parser.add_argument("--mix", default=LOAD_MIX, help="доли операций, операция:вес через запятую")
+    parser.add_argument("--seed", type=int, help="начальное значение генератора случайных чисел")
+    parser.add_argument("--json", help="записать отчет в JSON-файл")
+    args = parser.parse_args()
+
+    kwargs = {"users": args.users, "requests_count": args.requests, "concurrency": args.concurrency,
+              "limits": parse_weights(args.limits), "mix": parse_weights(args.mix), "seed": args.seed}
+    if args.url:
+        report = asyncio.run(run_remote(args.url, **kwargs))
+    else:
+        os.environ["SUNDARAM_DATA_DIR"] = args.data_dir or tempfile.mkdtemp(prefix="sundaram_load_")
+        print(f"Каталог данных: {os.environ['SUNDARAM_DATA_DIR']}")
+        report = asyncio.run(run_in_process(**kwargs))
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
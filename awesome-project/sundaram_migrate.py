@@ -0,0 +1,67 @@
+import argparse
+import json
+import os
+
+from sundaram_storage import JsonStorage, SqliteStorage, DATA_DIR, DB_PATH
+from sundaram_models import User
+
+def migrate(data_dir: str, db_path: str) -> dict:
+    # источник только читается: без создания каталогов, перевода старой истории в журнал и отметок LRU,
+    # поэтому после отката транзакции или повторного запуска JSON-файлы остаются прежними
+    source = JsonStorage(User, data_dir)
+    if os.path.isdir(source.directory):
+        source.refresh(force=True)
+    target = SqliteStorage(User, db_path)
+    target.load()
+    conn = target.connection()
+
+    stats = {"users": 0, "saved_params": 0, "history": 0, "results": 0}
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for user_id in sorted(source.by_id):
+            user = source.get(user_id)
+            # повторный запуск не дублирует данные: пользователь и его параметры перезаписываются
+            conn.execute("DELETE FROM saved_params WHERE user_id = ?", (user.id,))
+            conn.execute(
+                "INSERT OR REPLACE INTO users (id, login, email, password, technical_token, session_token, "
+                "sundaram_params) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (user.id, user.login, user.email, user.password, user.technical_token, user.session_token,
+                 json.dumps(user.sundaram_params)))
+            for param in user.saved_params:
+                target._insert_param(conn, user.id, param)
+            stats["users"] += 1
+            stats["saved_params"] += len(user.saved_params)
+
+            # история переносится, только если у пользователя ее еще нет в базе
+            if conn.execute("SELECT 1 FROM history WHERE user_id = ? LIMIT 1", (user.id,)).fetchone() is None:
+                for entry in source.read_history(user.id):
+                    target.append_history(user.id, entry)
+                    stats["history"] += 1
+
+        if os.path.isdir(source.results.directory):
+            for name in os.listdir(source.results.directory):
+                if name.startswith("result_") and name.endswith(".bin"):
+                    limit = int(name[len("result_"):-len(".bin")])
+                    target.put_result(limit, source.results.get(limit, touch=False))
+                    stats["results"] += 1
+
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Перенос JSON-файлов users/, history/ и results/ в базу SQLite")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="каталог с users/, history/ и results/")
+    parser.add_argument("--db", default=DB_PATH, help="путь к базе SQLite")
+    args = parser.parse_args()
+
+    stats = migrate(args.data_dir, args.db)
+    print(f"Перенесено: пользователей {stats['users']}, параметров {stats['saved_params']}, "
+          f"записей истории {stats['history']}, результатов {stats['results']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+from typing import Union, List
+from pydantic import BaseModel
+
+# модели API без побочных эффектов при импорте: их используют сервер, миграция, тесты и бенчмарки
+
+class User(BaseModel):
+    login: str
+    email: str
+    password: str
+    technical_token: Union[str, None] = None
+    session_token: Union[str, None] = None
+    id: Union[int, None] = -1
+    sundaram_params: dict = {}
+    saved_params: List[dict] = []
+
+class AuthUser(BaseModel):
+    login: str
+    password: str
+
+class SundaramGenerateRequest(BaseModel):
+    limit: int
+
+class SaveParamsRequest(BaseModel):
+    name: str
+    limit: int
+
+class PasswordChange(BaseModel):
+    old_password: str
+    new_password: str
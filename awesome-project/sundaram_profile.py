@@ -0,0 +1,156 @@
+from contextvars import ContextVar
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+
+# Профилирование отдельного запроса: сервер запускается с SUNDARAM_PROFILE=1, запрос присылает заголовок
+#   X-Profile: pstats  - детерминированный cProfile: <id>.pstats и текстовая сводка <id>.txt
+#   X-Profile: sample  - сэмплирование стеков: <id>.collapsed для flamegraph.pl / speedscope
+# Без флага middleware не подключается вовсе, без заголовка запрос проходит без изменений
+PROFILE_ENABLED = os.environ.get("SUNDARAM_PROFILE", "0") == "1"
+PROFILE_DIR = os.environ.get("SUNDARAM_PROFILE_DIR", os.path.join(os.environ.get("SUNDARAM_DATA_DIR", "."), "profiles"))
+PROFILE_INTERVAL = float(os.environ.get("SUNDARAM_PROFILE_INTERVAL", 0.001))
+PROFILE_HEADER = b"x-profile"
+PROFILE_ID_HEADER = b"x-profile-id"
+
+current_profile = ContextVar("current_profile", default=None)
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class RequestProfile:
+    def __init__(self, mode: str, directory: str = None):
+        self.mode = "sample" if mode == "sample" else "pstats"
+        self.directory = directory or PROFILE_DIR
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.threads = {}
+        self.profiles = []
+        self.stacks = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._profiler = None
+        self._sampler = None
+
+    def start(self):
+        self.threads[threading.get_ident()] = "event_loop"
+        if self.mode == "pstats":
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._sampler = threading.Thread(target=self._sample, name="sundaram-profiler", daemon=True)
+            self._sampler.start()
+
+    def stop(self):
+        if self._profiler is not None:
+            self._profiler.disable()
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+
+    def wrap(self, call):
+        # работа запроса в пуле потоков профилируется вместе с циклом событий
+        def profiled():
+            ident = threading.get_ident()
+            with self._lock:
+                self.threads[ident] = threading.current_thread().name
+            if self.mode == "sample":
+                try:
+                    return call()
+                finally:
+                    with self._lock:
+                        self.threads.pop(ident, None)
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Python 3.12+: cProfile работает через sys.monitoring, профилировщик один на интерпретатор
+                # и уже включен в цикле событий; он видит и этот поток, второй не нужен
+                profiler = None
+            try:
+                return call()
+            finally:
+                with self._lock:
+                    if profiler is not None:
+                        profiler.disable()
+                        self.profiles.append(profiler)
+                    self.threads.pop(ident, None)
+        return profiled
+
+    def _sample(self):
+        while not self._stop.wait(PROFILE_INTERVAL):
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(self.threads.items())
+            for ident, thread_name in threads:
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    stack.append(frame_name(frame))
+                    frame = frame.f_back
+                if stack:
+                    key = ";".join([thread_name] + stack[::-1])
+                    self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def save(self) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, self.id)
+        if self.mode == "sample":
+            with open(f"{base}.collapsed", 'w') as f:
+                for stack, count in sorted(self.stacks.items()):
+                    f.write(f"{stack} {count}\n")
+            return f"{base}.collapsed"
+
+        stats = pstats.Stats(self._profiler)
+        for profiler in self.profiles:
+            stats.add(profiler)
+        stats.dump_stats(f"{base}.pstats")
+        summary = io.StringIO()
+        pstats.Stats(f"{base}.pstats", stream=summary).sort_stats("cumulative").print_stats(50)
+        with open(f"{base}.txt", 'w') as f:
+            f.write(summary.getvalue())
+        return f"{base}.pstats"
+
+class ProfilerMiddleware:
+    # одновременно профилируется один запрос: cProfile в потоке цикла событий видит и соседние запросы,
+    # а второй профилировщик в том же потоке невозможен
+    def __init__(self, app, directory: str = None):
+        self.app = app
+        self.directory = directory
+        self._busy = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self._busy:
+            await self.app(scope, receive, send)
+            return
+        mode = None
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                mode = value.decode()
+        if mode is None:
+            await self.app(scope, receive, send)
+            return
+
+        self._busy = True
+        profile = RequestProfile(mode, self.directory)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(PROFILE_ID_HEADER, profile.id.encode())]
+            await send(message)
+
+        token = current_profile.set(profile)
+        profile.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profile.stop()
+            current_profile.reset(token)
+            self._busy = False
+            await asyncio.get_running_loop().run_in_executor(None, profile.save)
@@ -0,0 +1,87 @@
+from typing import List, Union
+from array import array
+import os
+import threading
+
+from sundaram_codec import write_varint, read_varint, encode_gaps, decode_gaps_array
+
+RESULTS_DIR = os.environ.get("SUNDARAM_RESULTS_DIR", os.path.join(os.environ.get("SUNDARAM_DATA_DIR", "."), "results"))
+# объем всех сохраненных результатов; сверх него удаляются самые давно читавшиеся
+RESULTS_MAX_BYTES = int(os.environ.get("SUNDARAM_RESULTS_MAX_BYTES", 256 << 20))
+
+def encode_result(primes: List[int]) -> bytes:
+    data = bytearray()
+    write_varint(data, len(primes))
+    data += encode_gaps(primes)
+    return bytes(data)
+
+def decode_result(data: bytes) -> array:
+    count, pos = read_varint(data, 0)
+    return decode_gaps_array(memoryview(data)[pos:], count)
+
+class ResultStore:
+    # результаты не зависят от пользователя: список простых однозначно задается limit,
+    # поэтому файл result_<limit>.bin один на всех пользователей.
+    # Хранилище ограничено max_bytes: время изменения файла - время последнего чтения (LRU)
+    def __init__(self, directory: str = None, max_bytes: int = None):
+        self.directory = directory or RESULTS_DIR
+        self.max_bytes = RESULTS_MAX_BYTES if max_bytes is None else max_bytes
+
+    def path(self, limit: int) -> str:
+        return os.path.join(self.directory, f"result_{limit}.bin")
+
+    def put(self, limit: int, primes: List[int]):
+        path = self.path(limit)
+        if os.path.exists(path):
+            return
+
+        data = encode_result(primes)
+        if len(data) > self.max_bytes:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        # имя временного файла уникально для потока: один limit могут записывать несколько запросов сразу
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.startswith("result_") and entry.name.endswith(".bin"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def get(self, limit: int, touch: bool = True) -> Union[array, None]:
+        # touch=False - только чтение, без отметки для LRU (перенос данных не меняет источник)
+        path = self.path(limit)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        if touch:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+        return decode_result(data)
@@ -1,67 +1,199 @@
-from typing import Union, List
+from typing import Union, AsyncIterator
+from array import array
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Request
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse, Response, JSONResponse
 import json
 import time
 import os
 import random
 import hashlib
 
-app = FastAPI(title="Sundaram Resheto API", description="API для генерации простых чисел методом Решета Сундарама")
+from sundaram_sieve import sieve_primes, sieve_range, sieve_count, with_stats, prime_table, table_memory
+from sundaram_table import open_table
+from sundaram_codec import PRIMES_MEDIA_TYPE, PAYLOAD_JSON_TAIL, encode_primes_payload, encode_payload_head, \
+    encode_primes_slice
+from sundaram_storage import open_storage, history_entry, parse_time, AlreadyExists
+from sundaram_executor import executors, Overloaded, SingleFlight
+from sundaram_jobs import JobManager, Job, TooManyJobs, JobTooLarge, QUEUED, RUNNING, DONE, FAILED, CANCELLED
+from sundaram_metrics import Registry, MetricsMiddleware, CONTENT_TYPE, SIZE_BUCKETS
+from sundaram_profile import PROFILE_ENABLED, ProfilerMiddleware
+from sundaram_models import User, AuthUser, SundaramGenerateRequest, SaveParamsRequest, PasswordChange
 
-class User(BaseModel):
-    login: str
-    email: str
-    password: str
-    technical_token: Union[str, None] = None
-    session_token: Union[str, None] = None
-    id: Union[int, None] = -1
-    current_primes: List[int] = []
-    sundaram_params: dict = {}
-    saved_params: List[dict] = []
+# хранилище открывается при запуске приложения: импорт модуля не трогает каталог данных и не запускает поток записи
+storage = None
+# статистика prime_table из последнего ответа процесса решета
+table_stats = None
 
-class AuthUser(BaseModel):
-    login: str
-    password: str
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global storage
+    storage = open_storage(User)
+    # процесс решета запускается заранее, чтобы первый запрос не ждал импорта numpy
+    await sieve(sieve_count, 2)
+    yield
+    # при остановке дописываем очередь отложенной записи
+    jobs.shutdown()
+    executors.shutdown()
+    storage.close()
 
-class SundaramGenerateRequest(BaseModel):
-    limit: int
+app = FastAPI(title="Sundaram Resheto API", description="API для генерации простых чисел методом Решета Сундарама",
+              lifespan=lifespan)
 
-class SaveParamsRequest(BaseModel):
-    name: str
-    limit: int
+metrics = Registry()
+http_requests = metrics.counter("sundaram_http_requests_total", "Число HTTP-запросов", ("route", "method", "status"))
+http_latency = metrics.histogram("sundaram_http_request_duration_seconds", "Время обработки HTTP-запроса",
+                                 ("route", "method"))
+stage_latency = metrics.histogram("sundaram_stage_duration_seconds", "Время этапов обработки запроса", ("stage",))
+result_size = metrics.histogram("sundaram_result_primes", "Количество простых чисел в ответе", buckets=SIZE_BUCKETS)
+users_gauge = metrics.gauge("sundaram_users", "Число пользователей в хранилище")
+cache_hit_ratio = metrics.gauge("sundaram_cache_hit_ratio", "Доля запросов, обслуженных из кэша", ("cache",))
+prime_table_gauge = metrics.gauge("sundaram_prime_table", "Таблица простых процесса решета", ("value",))
+heavy_gauge = metrics.gauge("sundaram_heavy_tasks", "Тяжелые задачи решета", ("state",))
+jobs_gauge = metrics.gauge("sundaram_jobs", "Фоновые задачи по статусам", ("status",))
+app.add_middleware(MetricsMiddleware, requests=http_requests, latency=http_latency)
+if PROFILE_ENABLED:
+    app.add_middleware(ProfilerMiddleware)
 
-class PasswordChange(BaseModel):
-    old_password: str
-    new_password: str
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+STREAM_CHUNK_SIZE = int(os.environ.get("SUNDARAM_STREAM_CHUNK_SIZE", 65536))
+STREAM_WINDOW = int(os.environ.get("SUNDARAM_STREAM_WINDOW", 1 << 23))
+# простые в ответе кодируются кусками по ENCODE_SLICE: GIL занят одним коротким куском, а не всем списком
+ENCODE_SLICE = int(os.environ.get("SUNDARAM_ENCODE_SLICE", 1 << 16))
+JOB_WINDOW = int(os.environ.get("SUNDARAM_JOB_WINDOW", 1 << 22))
+# потолок результата обычного ответа (generate, current, range): весь список простых держится в памяти как
+# array('q'), 8 байт на простое, оценка - table_memory. По умолчанию 256 МБ - около 3.4e7 простых, limit до ~6.4e8.
+# Выше - 413: такой результат отдается только потоком NDJSON или фоновой задачей /sundaram/jobs
+RESPONSE_MAX_BYTES = int(os.environ.get("SUNDARAM_RESPONSE_MAX_BYTES", 256 << 20))
+HISTORY_PAGE_LIMIT = int(os.environ.get("SUNDARAM_HISTORY_PAGE_LIMIT", 100))
+HISTORY_MAX_PAGE_LIMIT = int(os.environ.get("SUNDARAM_HISTORY_MAX_PAGE_LIMIT", 1000))
+# подписи старых клиентов без X-User-Id/X-Timestamp: перебор всех сессий; "0" - такие запросы отклоняются
+LEGACY_SIGNATURES = os.environ.get("SUNDARAM_LEGACY_SIGNATURES", "1") == "1"
 
-def resheto_sundarama(limit: int) -> List[int]:
+prime_file = open_table()
 
-    if limit < 2:
-        return []
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(status_code=503, content={"detail": "Сервер перегружен, повторите запрос позже"},
+                        headers={"Retry-After": "1"})
 
-    n = (limit - 1) // 2
-    
-    reshet = [True] * (n + 1)
-    
-    for i in range(1, n + 1):
-        j = i
-        while i + j + 2 * i * j <= n:
-            k = i + j + 2 * i * j
-            if k <= n:
-                reshet[k] = False
-            j += 1
-    
-    primes = [2]
-        
-    for i in range(1, n + 1):
-        if reshet[i]:
-            prime = 2 * i + 1
-            if prime <= limit:
-                primes.append(prime)
-    
+# срез большого результата - в потоке, а не в цикле событий
+flights = SingleFlight(executors.run_io)
+
+def timed(stage: str, func, *args):
+    with stage_latency.labels(stage).time():
+        return func(*args)
+
+async def sieve(func, *args):
+    global table_stats
+    with stage_latency.labels("sieve").time():
+        result, table_stats = await executors.run_sieve_unlimited(with_stats, func, *args)
+    return result
+
+async def run_sieve(func, *args):
+    async with executors.heavy_slot():
+        return await sieve(func, *args)
+
+def check_result_size(memory: int, hint: str):
+    if memory > RESPONSE_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Результат слишком большой для одного ответа: {hint}")
+
+def covered_by_file(limit: int) -> bool:
+    return prime_file is not None and limit <= prime_file.limit
+
+def worth_storing(limit: int) -> bool:
+    # результат зависит только от limit: то, что отдают файл таблицы или prime_table, не сохраняется
+    return not covered_by_file(limit) and limit > prime_table.max_limit
+
+async def find_primes(limit: int) -> array:
+    # таблица в файле читается в потоке, решето считается в процессе пула со своим кэшем prime_table;
+    # результат остается массивом array('q') до кодирования ответа кусками
+    if covered_by_file(limit):
+        return await executors.run_io(prime_file.primes_array, 0, limit)
+    return await flights.run(limit, lambda flight_limit: run_sieve(sieve_primes, flight_limit))
+
+async def load_result(limit: int) -> array:
+    # текущий результат пользователя восстанавливается по limit: таблица, хранилище, решето
+    if covered_by_file(limit):
+        return await executors.run_io(prime_file.primes_array, 0, limit)
+    if not worth_storing(limit):
+        return await find_primes(limit)
+    primes = await executors.run_io(storage.get_result, limit)
+    if primes is not None:
+        return primes
+    primes = await find_primes(limit)
+    await executors.run_io(storage.put_result, limit, primes)
     return primes
 
+async def iter_primes(limit: int) -> AsyncIterator[array]:
+    if covered_by_file(limit):
+        for lo in range(0, limit + 1, STREAM_WINDOW):
+            yield await executors.run_io(prime_file.primes_array, lo, min(lo + STREAM_WINDOW - 1, limit))
+        return
+    # поток занимает один слот тяжелых задач на все время генерации
+    async with executors.heavy_slot(reject=False):
+        for lo in range(0, limit + 1, STREAM_WINDOW):
+            yield await sieve(sieve_range, lo, min(lo + STREAM_WINDOW - 1, limit))
+
+async def primes_response(request_obj: Request, payload: dict) -> Response:
+    # JSON по умолчанию, компактный бинарный формат по заголовку Accept.
+    # Преобразование в список и сериализация - одиночные вызовы на C, которые держат GIL все время работы,
+    # поэтому большой список кодируется в потоке кусками по ENCODE_SLICE и сразу отдается клиенту:
+    # между кусками цикл событий обслуживает остальные запросы
+    primes = payload["primes"]
+    result_size.observe(len(primes))
+    binary = PRIMES_MEDIA_TYPE in request_obj.headers.get('Accept', '')
+    if len(primes) > ENCODE_SLICE:
+        return StreamingResponse(encode_payload(payload, binary),
+                                 media_type=PRIMES_MEDIA_TYPE if binary else "application/json")
+    
+    payload = {**payload, "primes": list(primes)}
+    with stage_latency.labels("serialization").time():
+        if binary:
+            return Response(content=encode_primes_payload(payload), media_type=PRIMES_MEDIA_TYPE)
+        return JSONResponse(payload)
+
+async def encode_payload(payload: dict, binary: bool) -> AsyncIterator[bytes]:
+    primes = payload["primes"]
+    elapsed = 0.0
+    yield encode_payload_head(payload, binary)
+    for lo in range(0, len(primes), ENCODE_SLICE):
+        start = time.perf_counter()
+        chunk = await executors.run_io(encode_primes_slice, primes, lo, min(lo + ENCODE_SLICE, len(primes)), binary)
+        elapsed += time.perf_counter() - start
+        yield chunk
+    if not binary:
+        yield PAYLOAD_JSON_TAIL
+    stage_latency.labels("serialization").observe(elapsed)
+
+async def rechunk(chunks: AsyncIterator[array], size: int) -> AsyncIterator[array]:
+    buffer = array('q')
+    async for chunk in chunks:
+        buffer.extend(chunk)
+        if len(buffer) >= size:
+            end = len(buffer) - len(buffer) % size
+            for start in range(0, end, size):
+                yield buffer[start:start + size]
+            del buffer[:end]
+    if buffer:
+        yield buffer
+
+def primes_line(chunk: array) -> bytes:
+    return (json.dumps({"primes": chunk.tolist()}) + "\n").encode()
+
+async def find_primes_range(lo: int, hi: int) -> array:
+    if covered_by_file(hi):
+        return await executors.run_io(prime_file.primes_array, lo, hi)
+    return await run_sieve(sieve_range, lo, hi)
+
+async def find_primes_count(limit: int) -> int:
+    if covered_by_file(limit):
+        return prime_file.count(limit)
+    return await run_sieve(sieve_count, limit)
+
+def sign(session_token: str, body_str: str, check_time: str) -> str:
+    return hashlib.sha256(f"{session_token}{body_str}{check_time}".encode()).hexdigest()
+
 def get_user_by_token(request: Request, body: dict = None) -> User:
     client_signature = request.headers.get('Authorization')
     if not client_signature:
@@ -70,174 +202,312 @@ def get_user_by_token(request: Request, body: dict = None) -> User:
     current_time = int(time.time())
     body_str = json.dumps(body) if body is not None else "{}"
     
+    user_id = request.headers.get('X-User-Id')
+    timestamp = request.headers.get('X-Timestamp')
+    if user_id and timestamp:
+        # клиент передал id и время подписи: проверяется ровно одна подпись
+        if not user_id.isdigit() or not timestamp.isdigit() or not 0 <= current_time - int(timestamp) <= 3:
+            raise HTTPException(status_code=401, detail="Неверная подпись")
+        user_id = int(user_id)
+        
+        user = storage.get(user_id)
+        if user is not None and sign(user.session_token, body_str, timestamp) == client_signature:
+            return user
+        
+        # токен мог смениться в другом процессе - перечитываем один файл
+        user = storage.reload(user_id)
+        if user is not None and sign(user.session_token, body_str, timestamp) == client_signature:
+            return user
+        raise HTTPException(status_code=401, detail="Неверная подпись")
+    
+    # старые клиенты без заголовков: один проход по сессиям в памяти; сессии других процессов
+    # подхватываются заранее (не чаще раза в REFRESH_INTERVAL), а не вторым перебором после промаха
+    if not LEGACY_SIGNATURES:
+        raise HTTPException(status_code=401, detail="Неверная подпись")
+    storage.refresh()
+    sessions = storage.sessions()
     for time_add in [-3, -2, -1, 0]:
         check_time = str(current_time + time_add)
-        
-        for file in os.listdir("users"):
-            with open(f"users/{file}", 'r') as f:
-                user_data = json.load(f)
-                user_token = user_data.get('session_token')
-                server_signature = hashlib.sha256(f"{user_token}{body_str}{check_time}".encode()).hexdigest()
-                if server_signature == client_signature:
-                    return User(**user_data)
+        for session_token, session_user_id in sessions:
+            if sign(session_token, body_str, check_time) == client_signature:
+                user = storage.get(session_user_id)
+                if user is not None and user.session_token == session_token:
+                    return user
     raise HTTPException(status_code=401, detail="Неверная подпись")
 
-def save_user(user: User):
-    with open(f"users/user_{user.id}.json", 'w') as f:
-        json.dump(user.model_dump(), f)
+def save_user(user: User) -> bool:
+    with stage_latency.labels("save_user").time():
+        return storage.save(user)
 
 def save_history(user_id: int, operation_type: str, details: str):
-    history_file = f"history/history_{user_id}.json"
-    if not os.path.exists(history_file):
-        return
-    
-    with open(history_file, 'r') as f:
-        history = json.load(f)
-    
-    current_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
-    history_add = {
-        "user": user_id,
-        "time": current_time,
-        "operation": operation_type,
-        "details": details
-    }
-    history.append(history_add)
-    
-    with open(history_file, 'w') as f:
-        json.dump(history, f, indent=2)
+    with stage_latency.labels("save_history").time():
+        storage.append_history(user_id, history_entry(user_id, operation_type, details))
+
+async def authorize(request_obj: Request, body: dict = None) -> User:
+    return await executors.run_io(timed, "signature_lookup", get_user_by_token, request_obj, body)
 
 @app.post("/users/register")
-def create_user(user: User):
-    if not os.path.exists("users"):
-        os.makedirs("users")
-    
-    for file in os.listdir("users"):
-        with open(f"users/{file}", 'r') as f:
-            data = json.load(f)
-            if data['login'] == user.login:
-                raise HTTPException(status_code=400, detail="Логин уже занят")
-            if data['email'] == user.email:
-                raise HTTPException(status_code=400, detail="Email уже занят")
-    
-    user.id = int(time.time())
+async def create_user(user: User):
+    return await executors.run_io(register_user, user)
+
+def register_user(user: User) -> dict:
     user.technical_token = str(random.getrandbits(128))
     user.session_token = hashlib.sha256(f"{user.technical_token}{time.time()}".encode()).hexdigest()
     
-    save_user(user)
-    
-    if not os.path.exists("history"):
-        os.makedirs("history")
-    
-    with open(f"history/history_{user.id}.json", 'w') as f:
-        json.dump([], f)
+    # уникальность логина и email проверяет само хранилище вместе с записью
+    try:
+        storage.create(user)
+    except AlreadyExists as e:
+        raise HTTPException(status_code=400, detail="Логин уже занят" if e.field == "login" else "Email уже занят")
+    storage.init_history(user.id)
     
     save_history(user.id, "register", "Пользователь зарегистрирован")
     return {
         "message": "Успешная регистрация",
         "login": user.login,
+        "user_id": user.id,
         "session_token": user.session_token
     }
 
 @app.post("/users/authenticate")
-def auth_user(params: AuthUser):
-    json_files_names = [file for file in os.listdir('users/') if file.endswith('.json')]
-    for json_file_name in json_files_names:
-        file_path = os.path.join('users/', json_file_name)
-        with open(file_path, 'r') as f:
-            json_item = json.load(f)
-            user = User(**json_item)
-            if user.login == params.login and user.password == params.password:
-                user.session_token = hashlib.sha256(f"{user.technical_token}{time.time()}".encode()).hexdigest()
-                save_user(user)
-                save_history(user.id, "auth", "Успешная авторизация")
-                return {
-                    "message": "Успешная авторизация",
-                    "login": user.login,
-                    "session_token": user.session_token
-                }
+async def auth_user(params: AuthUser):
+    return await executors.run_io(authenticate_user, params)
+
+def authenticate_user(params: AuthUser) -> dict:
+    user = storage.find_by_login(params.login)
+    if user is not None and user.password == params.password:
+        user.session_token = hashlib.sha256(f"{user.technical_token}{time.time()}".encode()).hexdigest()
+        save_user(user)
+        save_history(user.id, "auth", "Успешная авторизация")
+        return {
+            "message": "Успешная авторизация",
+            "login": user.login,
+            "user_id": user.id,
+            "session_token": user.session_token
+        }
     
     raise HTTPException(status_code=401, detail="Неверный логин или пароль")
 
 @app.post("/sundaram/generate")
-def generate_sundaram_primes(request: SundaramGenerateRequest, request_obj: Request):
-    user = get_user_by_token(request_obj, request.model_dump())
+async def generate_sundaram_primes(request: SundaramGenerateRequest, request_obj: Request):
+    user = await authorize(request_obj, request.model_dump())
     
     if request.limit < 1:
         raise HTTPException(status_code=400, detail="Верхняя граница должна быть положительным числом")
     
-    primes = resheto_sundarama(request.limit)
+    if NDJSON_MEDIA_TYPE in request_obj.headers.get('Accept', ''):
+        if not covered_by_file(request.limit) and executors.overloaded():
+            raise Overloaded()
+        return StreamingResponse(stream_sundaram_primes(user, request.limit), media_type=NDJSON_MEDIA_TYPE)
     
-    user.current_primes = primes
-    user.sundaram_params = {
+    check_result_size(table_memory(request.limit),
+                      f"запросите поток (Accept: {NDJSON_MEDIA_TYPE}) или создайте задачу /sundaram/jobs")
+    primes = await find_primes(request.limit)
+    
+    await executors.run_io(save_generated, user, request.limit, primes, len(primes))
+    
+    return await primes_response(request_obj, {
+        "message": f"Найдено {len(primes)} простых чисел до {request.limit}",
+        "primes": primes,
         "limit": request.limit,
         "count": len(primes)
+    })
+
+def save_generated(user: User, limit: int, primes: Union[array, None], count: int):
+    # в файле пользователя хранится только ссылка на результат (limit и count)
+    if primes is not None and worth_storing(limit):
+        storage.put_result(limit, primes)
+    
+    user.sundaram_params = {
+        "limit": limit,
+        "count": count
     }
     save_user(user)
 
     save_history(user.id, "sundaram_generate", 
-                 f"Сгенерировано {len(primes)} простых чисел до {request.limit}")
+                 f"Сгенерировано {count} простых чисел до {limit}")
+
+async def stream_sundaram_primes(user: User, limit: int) -> AsyncIterator[bytes]:
+    # NDJSON: строка {"primes": [...]} на каждый кусок и итоговая строка с количеством
+    count = 0
+    async for chunk in rechunk(iter_primes(limit), STREAM_CHUNK_SIZE):
+        count += len(chunk)
+        yield await executors.run_io(primes_line, chunk)
+    
+    result_size.observe(count)
+    await executors.run_io(save_generated, user, limit, None, count)
+    
+    yield (json.dumps({
+        "message": f"Найдено {count} простых чисел до {limit}",
+        "limit": limit,
+        "count": count
+    }) + "\n").encode()
+
+async def run_job(job: Job):
+    # задача считается окнами: между окнами обновляется прогресс и срабатывает отмена;
+    # очередь задач своя (JobManager), слоты тяжелых задач и их очередь не занимаются
+    job.status = RUNNING
+    covered = covered_by_file(job.limit)
+    for lo in range(0, job.limit + 1, JOB_WINDOW):
+        hi = min(lo + JOB_WINDOW - 1, job.limit)
+        if covered:
+            job.add(await executors.run_io(prime_file.primes_array, lo, hi), hi)
+        else:
+            job.add(await sieve(sieve_range, lo, hi), hi)
+
+async def finish_job(job: Job):
+    # готовая задача становится текущим результатом пользователя, как обычная генерация
+    user = await executors.run_io(storage.get, job.user_id)
+    if user is not None:
+        await executors.run_io(save_generated, user, job.limit, job.primes, job.count)
+
+jobs = JobManager(run_job, finish_job)
+
+def find_job(user: User, job_id: str) -> Job:
+    job = jobs.get(user.id, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job
+
+@app.post("/sundaram/jobs", status_code=202)
+async def create_job(request: SundaramGenerateRequest, request_obj: Request):
+    user = await authorize(request_obj, request.model_dump())
     
-    return {
-        "message": f"Найдено {len(primes)} простых чисел до {request.limit}",
-        "primes": primes,
-        "limit": request.limit,
-        "count": len(primes)
-    }
+    if request.limit < 1:
+        raise HTTPException(status_code=400, detail="Верхняя граница должна быть положительным числом")
+    
+    try:
+        job = jobs.submit(user.id, request.limit)
+    except JobTooLarge:
+        raise HTTPException(status_code=413, detail="Результат задачи не поместится в память сервера")
+    except TooManyJobs:
+        raise HTTPException(status_code=429, detail="Слишком много активных задач")
+    
+    await executors.run_io(save_history, user.id, "sundaram_job", f"Создана задача {job.id} (limit={request.limit})")
+    return {"message": "Задача создана", **job.info()}
+
+@app.get("/sundaram/jobs/{job_id}")
+async def get_job(job_id: str, request_obj: Request):
+    user = await authorize(request_obj)
+    job = find_job(user, job_id)
+    
+    return {"message": f"Задача {job.status}", **job.info()}
+
+@app.get("/sundaram/jobs/{job_id}/result")
+async def get_job_result(job_id: str, request_obj: Request):
+    user = await authorize(request_obj)
+    job = find_job(user, job_id)
+    
+    if job.status != DONE:
+        raise HTTPException(status_code=409, detail=f"Результат недоступен, статус задачи: {job.status}")
+    
+    return await primes_response(request_obj, {
+        "message": f"Найдено {job.count} простых чисел до {job.limit}",
+        "primes": job.primes,
+        "limit": job.limit,
+        "count": job.count,
+        "job_id": job.id
+    })
+
+@app.delete("/sundaram/jobs/{job_id}")
+async def cancel_job(job_id: str, request_obj: Request):
+    user = await authorize(request_obj)
+    job = find_job(user, job_id)
+    
+    if not jobs.cancel(job):
+        raise HTTPException(status_code=409, detail=f"Задача уже завершена со статусом {job.status}")
+    
+    await executors.run_io(save_history, user.id, "sundaram_job_cancel", f"Отменена задача {job.id}")
+    return {"message": "Задача отменена", **job.info()}
 
 @app.get("/sundaram/current")
-def get_current_primes(request_obj: Request):
-    user = get_user_by_token(request_obj)
+async def get_current_primes(request_obj: Request):
+    user = await authorize(request_obj)
     
-    if not user.current_primes:
+    if not user.sundaram_params.get("count"):
         raise HTTPException(status_code=404, detail="Результат не найден")
     
-    save_history(user.id, "sundaram_get", f"Получен список из {len(user.current_primes)} простых чисел")
-    return {
-        "message": f"Текущий результат ({len(user.current_primes)} простых чисел)",
-        "primes": user.current_primes,
+    check_result_size(table_memory(user.sundaram_params["limit"]),
+                      f"получите его потоком через /sundaram/generate (Accept: {NDJSON_MEDIA_TYPE})")
+    primes = await load_result(user.sundaram_params["limit"])
+    
+    await executors.run_io(save_history, user.id, "sundaram_get", f"Получен список из {len(primes)} простых чисел")
+    return await primes_response(request_obj, {
+        "message": f"Текущий результат ({len(primes)} простых чисел)",
+        "primes": primes,
         "params": user.sundaram_params
+    })
+
+@app.get("/sundaram/range")
+async def get_primes_range(lo: int, hi: int, request_obj: Request):
+    user = await authorize(request_obj)
+
+    if lo < 0 or hi < lo:
+        raise HTTPException(status_code=400, detail="Диапазон должен удовлетворять условию 0 <= lo <= hi")
+
+    # в диапазоне не больше простых, чем до hi, и не больше, чем нечетных чисел в нем
+    check_result_size(min(table_memory(hi), 8 * ((hi - lo) // 2 + 2)), "уменьшите диапазон")
+    primes = await find_primes_range(lo, hi)
+
+    await executors.run_io(save_history, user.id, "sundaram_range", f"Найдено {len(primes)} простых чисел в диапазоне [{lo}, {hi}]")
+    return await primes_response(request_obj, {
+        "message": f"Найдено {len(primes)} простых чисел в диапазоне [{lo}, {hi}]",
+        "primes": primes,
+        "lo": lo,
+        "hi": hi,
+        "count": len(primes)
+    })
+
+@app.get("/sundaram/count")
+async def get_primes_count(limit: int, request_obj: Request):
+    user = await authorize(request_obj)
+
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="Верхняя граница должна быть положительным числом")
+
+    count = await find_primes_count(limit)
+
+    await executors.run_io(save_history, user.id, "sundaram_count", f"Посчитано {count} простых чисел до {limit}")
+    return {
+        "message": f"Количество простых чисел до {limit}: {count}",
+        "limit": limit,
+        "count": count
     }
 
 @app.delete("/sundaram/current")
-def delete_current_primes(request_obj: Request):
-    user = get_user_by_token(request_obj)
+async def delete_current_primes(request_obj: Request):
+    user = await authorize(request_obj)
     
-    user.current_primes = []
     user.sundaram_params = {}
-    save_user(user)
+    await executors.run_io(save_user, user)
     
-    save_history(user.id, "sundaram_delete", "Результат удален")
+    await executors.run_io(save_history, user.id, "sundaram_delete", "Результат удален")
     return {"message": "Результат удален", "primes": []}
 
 @app.post("/sundaram/save_params")
-def save_parameters(request: SaveParamsRequest, request_obj: Request):
-    user = get_user_by_token(request_obj, request.model_dump())
-    
-    if not hasattr(user, 'saved_params'):
-        user.saved_params = []
-    
-    for param in user.saved_params:
-        if param.get('name') == request.name:
-            raise HTTPException(status_code=400, detail="Параметры с таким именем уже существуют")
+async def save_parameters(request: SaveParamsRequest, request_obj: Request):
+    user = await authorize(request_obj, request.model_dump())
     
-    user.saved_params.append({
+    total_saved = await executors.run_io(storage.add_saved_param, user.id, {
         "name": request.name,
         "limit": request.limit,
         "created_at": time.strftime('%Y-%m-%d %H:%M:%S')
     })
     
-    save_user(user)
-    save_history(user.id, "save_params", f"Сохранены параметры '{request.name}' (limit={request.limit})")
+    if total_saved is None:
+        raise HTTPException(status_code=400, detail="Параметры с таким именем уже существуют")
+    
+    await executors.run_io(save_history, user.id, "save_params", f"Сохранены параметры '{request.name}' (limit={request.limit})")
     
     return {
         "message": "Параметры сохранены",
         "name": request.name,
-        "total_saved": len(user.saved_params)
+        "total_saved": total_saved
     }
 
 @app.get("/sundaram/saved_params")
-def get_saved_parameters(request_obj: Request):
-    user = get_user_by_token(request_obj)
+async def get_saved_parameters(request_obj: Request):
+    user = await authorize(request_obj)
     
     if not hasattr(user, 'saved_params') or not user.saved_params:
         return {"message": "Нет сохраненных параметров", "params": []}
@@ -248,81 +518,99 @@ def get_saved_parameters(request_obj: Request):
     }
 
 @app.delete("/sundaram/saved_params/{param_name}")
-def delete_saved_parameters(param_name: str, request_obj: Request):
-    user = get_user_by_token(request_obj)
-    
-    if not hasattr(user, 'saved_params'):
-        raise HTTPException(status_code=404, detail="Нет сохраненных параметров")
+async def delete_saved_parameters(param_name: str, request_obj: Request):
+    user = await authorize(request_obj)
     
-    original_count = len(user.saved_params)
-    user.saved_params = [p for p in user.saved_params if p.get('name') != param_name]
+    remaining = await executors.run_io(storage.delete_saved_param, user.id, param_name)
     
-    if len(user.saved_params) == original_count:
+    if remaining is None:
         raise HTTPException(status_code=404, detail="Параметры с таким именем не найдены")
     
-    save_user(user)
-    save_history(user.id, "delete_params", f"Удалены параметры '{param_name}'")
+    await executors.run_io(save_history, user.id, "delete_params", f"Удалены параметры '{param_name}'")
     
     return {
         "message": "Параметры удалены",
         "deleted_name": param_name,
-        "remaining": len(user.saved_params)
+        "remaining": remaining
     }
 
 @app.get("/users/history")
-def get_user_history(request_obj: Request):
-    user = get_user_by_token(request_obj)
-    
-    history_file = f"history/history_{user.id}.json"
-    
-    with open(history_file, 'r') as f:
-        history = json.load(f)
+async def get_user_history(request_obj: Request, cursor: int = 0, limit: int = HISTORY_PAGE_LIMIT,
+                           since: Union[str, None] = None, until: Union[str, None] = None):
+    user = await authorize(request_obj)
+    
+    if cursor < 0 or not 1 <= limit <= HISTORY_MAX_PAGE_LIMIT:
+        raise HTTPException(status_code=400, detail=f"Размер страницы должен быть от 1 до {HISTORY_MAX_PAGE_LIMIT}")
+    try:
+        for value in (since, until):
+            if value:
+                parse_time(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Время должно быть в формате ГГГГ-ММ-ДД ЧЧ:ММ:СС")
+    
+    history, next_cursor = await executors.run_io(storage.get_history, user.id, cursor, limit, since, until)
         
     if history == []:
-        return {"message": "История пуста", "history": history}
+        return {"message": "История пуста", "history": history, "next_cursor": None}
     
     return {
         "message": "История запросов",
-        "history": history
+        "history": history,
+        "next_cursor": next_cursor
     }
 
 @app.delete("/users/history")
-def delete_user_history(request_obj: Request):
-    user = get_user_by_token(request_obj)
+async def delete_user_history(request_obj: Request):
+    user = await authorize(request_obj)
     
-    history_file = f"history/history_{user.id}.json"
-    if os.path.exists(history_file):
-        with open(history_file, 'w') as f:
-            json.dump([], f)
+    await executors.run_io(storage.clear_history, user.id)
             
     return {"message": "История удалена"}
 
 @app.patch("/users/password")
-def change_password(request: PasswordChange, request_obj: Request):
-    user = get_user_by_token(request_obj, request.model_dump())
+async def change_password(request: PasswordChange, request_obj: Request):
+    user = await authorize(request_obj, request.model_dump())
     
-    user_file = f"users/user_{user.id}.json"
-    if not os.path.exists(user_file):
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
-    
-    with open(user_file, 'r') as f:
-        user_data = json.load(f)
-    if user_data['password'] != request.old_password:
+    if user.password != request.old_password:
         raise HTTPException(status_code=400, detail="Неверный старый пароль")
     
-    user_data['password'] = request.new_password
-    user_data['technical_token'] = hashlib.sha256(f"{time.time()}{random.getrandbits(256)}".encode()).hexdigest()
-    user_data['session_token'] = hashlib.sha256(f"{user_data['technical_token']}{time.time()}".encode()).hexdigest()
+    user.password = request.new_password
+    user.technical_token = hashlib.sha256(f"{time.time()}{random.getrandbits(256)}".encode()).hexdigest()
+    user.session_token = hashlib.sha256(f"{user.technical_token}{time.time()}".encode()).hexdigest()
     
-    with open(user_file, 'w') as f:
-        json.dump(user_data, f)
-    save_history(user.id, "change_password", "Пароль изменен")
+    await executors.run_io(save_user, user)
+    await executors.run_io(save_history, user.id, "change_password", "Пароль изменен")
     
     return {
         "message": "Пароль изменен",
-        "new_session_token": user_data['session_token']
+        "new_session_token": user.session_token
     }
 
+@app.get("/metrics")
+async def get_metrics():
+    users_gauge.set(await executors.run_io(len, storage))
+    
+    # таблица простых живет в процессе решета: ее статистика приходит с каждым результатом решета
+    # (при нескольких процессах - от ответившего последним), поэтому /metrics не ждет очереди пула
+    stats = table_stats
+    if stats is not None:
+        lookups = stats["hits"] + stats["misses"]
+        cache_hit_ratio.labels("prime_table").set(stats["hits"] / lookups if lookups else 0)
+        prime_table_gauge.labels("limit").set(stats["limit"])
+        prime_table_gauge.labels("primes").set(stats["primes"])
+    flights_total = flights.started + flights.shared
+    cache_hit_ratio.labels("single_flight").set(flights.shared / flights_total if flights_total else 0)
+    
+    heavy_gauge.labels("active").set(executors.active)
+    heavy_gauge.labels("waiting").set(executors.waiting)
+    counts = {}
+    for job in list(jobs.jobs.values()):
+        counts[job.status] = counts.get(job.status, 0) + 1
+    for status in (QUEUED, RUNNING, DONE, FAILED, CANCELLED):
+        jobs_gauge.labels(status).set(counts.get(status, 0))
+    
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE)
+
 if __name__ == "__main__":
     import uvicorn
     print("Сервер Sundaram Sieve запущен на http://localhost:8000")
@@ -0,0 +1,408 @@
+from typing import List, Iterator, Union
+from itertools import compress
+from math import isqrt, log
+from collections import deque
+from array import array
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+import os
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SIEVE_MEMORY_LIMIT = int(os.environ.get("SUNDARAM_SIEVE_MEMORY_LIMIT", 256 * 1024 * 1024))
+SIEVE_SEGMENT_SIZE = int(os.environ.get("SUNDARAM_SIEVE_SEGMENT_SIZE", 1 << 22))
+SIEVE_WORKERS = int(os.environ.get("SUNDARAM_SIEVE_WORKERS", os.cpu_count() or 1))
+SIEVE_PARALLEL_THRESHOLD = int(os.environ.get("SUNDARAM_SIEVE_PARALLEL_THRESHOLD", 20_000_000))
+PRIME_TABLE_MAX_LIMIT = int(os.environ.get("SUNDARAM_PRIME_TABLE_MAX_LIMIT", 100_000_000))
+PRIME_TABLE_EVICTION = os.environ.get("SUNDARAM_PRIME_TABLE_EVICTION", "truncate")
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+def resheto_sundarama_naive(limit: int) -> List[int]:
+
+    if limit < 2:
+        return []
+
+    n = (limit - 1) // 2
+
+    reshet = [True] * (n + 1)
+
+    for i in range(1, n + 1):
+        j = i
+        while i + j + 2 * i * j <= n:
+            k = i + j + 2 * i * j
+            if k <= n:
+                reshet[k] = False
+            j += 1
+
+    primes = [2]
+
+    for i in range(1, n + 1):
+        if reshet[i]:
+            prime = 2 * i + 1
+            if prime <= limit:
+                primes.append(prime)
+
+    return primes
+
+def new_buffer(size: int):
+    if np is not None:
+        return np.ones(size, dtype=np.uint8)
+    return bytearray(b'\x01') * size
+
+def cross_off(reshet, start: int, step: int):
+    # вычеркиваем всю прогрессию start, start + step, ... одной операцией
+    if start >= len(reshet):
+        return
+    if np is not None:
+        reshet[start::step] = 0
+    else:
+        reshet[start::step] = bytes(len(range(start, len(reshet), step)))
+
+def collect_primes(reshet, offset: int = 0) -> List[int]:
+    # индекс k в буфере соответствует числу 2 * (offset + k) + 1
+    if np is not None:
+        indices = np.flatnonzero(reshet)
+        return (2 * (indices + offset) + 1).tolist()
+    return [2 * k + 1 for k in compress(range(offset, offset + len(reshet)), reshet)]
+
+def count_marks(reshet) -> int:
+    if np is not None:
+        return int(np.count_nonzero(reshet))
+    return reshet.count(1)
+
+def sieve_indices(n: int):
+    reshet = new_buffer(n + 1)
+    reshet[0] = 0
+
+    i = 1
+    while 2 * i * (i + 1) <= n:
+        # если 2i + 1 составное, его прогрессия уже покрыта прогрессией его делителя
+        if reshet[i]:
+            cross_off(reshet, 2 * i * (i + 1), 2 * i + 1)
+        i += 1
+
+    return reshet
+
+def estimate_memory(limit: int) -> int:
+    # байт на индекс в буфере плюс временные массивы индексов простых (int64)
+    if limit < 2:
+        return 0
+    n = (limit - 1) // 2
+    return n + 1 + 16 * int(limit / log(limit) + 1)
+
+def base_indices(n: int) -> List[int]:
+    # индексы i, у которых 2i + 1 простое и прогрессия попадает в [1, n]
+    m = (isqrt(2 * n + 1) - 1) // 2
+    if m < 1:
+        return []
+    reshet = sieve_indices(m)
+    return [(p - 1) // 2 for p in collect_primes(reshet)]
+
+def sieve_window(lo: int, hi: int, bases: List[int]):
+    # буфер для индексов [lo, hi)
+    reshet = new_buffer(hi - lo)
+    if lo == 0:
+        reshet[0] = 0
+
+    for i in bases:
+        step = 2 * i + 1
+        start = 2 * i * (i + 1)
+        if start >= hi:
+            break
+        if start < lo:
+            start = lo + (i - lo) % step
+        cross_off(reshet, start - lo, step)
+
+    return reshet
+
+def iter_sundaram_segments(limit: int, segment_size: int = None) -> Iterator[List[int]]:
+
+    if limit < 2:
+        return
+
+    n = (limit - 1) // 2
+    segment_size = max(1, segment_size or SIEVE_SEGMENT_SIZE)
+    bases = base_indices(n)
+
+    yield [2]
+
+    for lo in range(0, n + 1, segment_size):
+        hi = min(lo + segment_size, n + 1)
+        yield collect_primes(sieve_window(lo, hi, bases), lo)
+
+def sieve_segment(lo: int, hi: int, bases: List[int]):
+    # выполняется в процессе пула: массив numpy передается между процессами быстрее списка
+    reshet = sieve_window(lo, hi, bases)
+    if np is not None:
+        return 2 * (np.flatnonzero(reshet) + lo) + 1
+    return collect_primes(reshet, lo)
+
+def get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=workers)
+            _pool_workers = workers
+        return _pool
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+def iter_windows(lo: int, hi: int, bases: List[int], workers: int = 1, segment_size: int = None) -> Iterator:
+    # простые с индексами [lo, hi) окнами по segment_size; при workers > 1 окна считаются в пуле процессов
+    segment_size = max(1, segment_size or SIEVE_SEGMENT_SIZE)
+    if workers <= 1:
+        for start in range(lo, hi, segment_size):
+            yield sieve_segment(start, min(start + segment_size, hi), bases)
+        return
+
+    # не больше 2 * workers сегментов в работе, чтобы результаты не копились в памяти
+    pool = get_pool(workers)
+    pending = deque()
+    for start in range(lo, hi, segment_size):
+        pending.append(pool.submit(sieve_segment, start, min(start + segment_size, hi), bases))
+        if len(pending) >= 2 * workers:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def iter_sundaram_segments_parallel(limit: int, workers: int = None, segment_size: int = None) -> Iterator[List[int]]:
+
+    if limit < 2:
+        return
+
+    workers = workers or SIEVE_WORKERS
+    n = (limit - 1) // 2
+    if segment_size is None:
+        segment_size = min(SIEVE_SEGMENT_SIZE, -(-(n + 1) // (workers * 4)))
+
+    yield [2]
+
+    for chunk in iter_windows(0, n + 1, base_indices(n), workers, segment_size):
+        yield chunk.tolist() if np is not None else chunk
+
+def resheto_sundarama_parallel(limit: int, workers: int = None, segment_size: int = None) -> List[int]:
+    primes = []
+    for chunk in iter_sundaram_segments_parallel(limit, workers, segment_size):
+        primes.extend(chunk)
+    return primes
+
+def resheto_sundarama_segmented(limit: int, segment_size: int = None) -> List[int]:
+    primes = []
+    for chunk in iter_sundaram_segments(limit, segment_size):
+        primes.extend(chunk)
+    return primes
+
+def resheto_sundarama(limit: int, workers: int = None) -> List[int]:
+
+    if limit < 2:
+        return []
+
+    workers = SIEVE_WORKERS if workers is None else workers
+    if workers > 1 and limit >= SIEVE_PARALLEL_THRESHOLD:
+        return resheto_sundarama_parallel(limit, workers)
+
+    if estimate_memory(limit) > SIEVE_MEMORY_LIMIT:
+        return resheto_sundarama_segmented(limit)
+
+    n = (limit - 1) // 2
+
+    reshet = sieve_indices(n)
+
+    return [2] + collect_primes(reshet)
+
+def iter_range_segments(lo: int, hi: int, segment_size: int = None) -> Iterator[List[int]]:
+    # простые p, lo <= p <= hi, сегментами по индексам Сундарама
+    if hi < 2 or hi < lo:
+        return
+
+    if lo <= 2:
+        yield [2]
+
+    n = (hi - 1) // 2
+    segment_size = max(1, segment_size or SIEVE_SEGMENT_SIZE)
+    bases = base_indices(n)
+
+    for start in range(max(1, lo // 2), n + 1, segment_size):
+        stop = min(start + segment_size, n + 1)
+        yield collect_primes(sieve_window(start, stop, bases), start)
+
+def resheto_sundarama_range(lo: int, hi: int) -> List[int]:
+    primes = []
+    for chunk in iter_range_segments(lo, hi):
+        primes.extend(chunk)
+    return primes
+
+def count_primes(limit: int, segment_size: int = None) -> int:
+    # pi(limit) посегментно, без построения списка
+    if limit < 2:
+        return 0
+
+    n = (limit - 1) // 2
+    segment_size = max(1, segment_size or SIEVE_SEGMENT_SIZE)
+    bases = base_indices(n)
+
+    count = 1
+    for lo in range(0, n + 1, segment_size):
+        count += count_marks(sieve_window(lo, min(lo + segment_size, n + 1), bases))
+    return count
+
+def table_memory(limit: int) -> int:
+    # 8 байт на простое в array('q'); pi(x) < x / ln x * (1 + 1.2762 / ln x) (Дюсар)
+    if limit < 3:
+        return 8
+    return 8 * int(limit / log(limit) * (1 + 1.2762 / log(limit)) + 1)
+
+def table_limit(memory: int) -> int:
+    # наибольший limit, таблица простых до которого помещается в memory байт
+    hi = 2
+    while table_memory(hi) <= memory:
+        hi *= 2
+    lo = 1
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if table_memory(mid) <= memory:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+def append_primes(primes: array, chunk):
+    if np is not None:
+        primes.frombytes(chunk.astype(np.int64, copy=False).tobytes())
+    else:
+        primes.extend(chunk)
+
+class SundaramSieve:
+    # досеивание окнами через sieve_window: между вызовами хранится только n,
+    # буфер отметок живет одно окно segment_size, а не всю жизнь процесса
+    def __init__(self, segment_size: int = None):
+        self.n = 0
+        self.segment_size = segment_size
+
+    def iter_extend(self, limit: int, workers: int = 1) -> Iterator:
+        # новые простые из (2 * old_n + 1, limit] окнами: массивы numpy, без numpy - списки
+        n = (limit - 1) // 2
+        if n <= self.n:
+            return
+        yield from iter_windows(self.n + 1, n + 1, base_indices(n), workers, self.segment_size)
+        self.n = n
+
+    def extend(self, limit: int, workers: int = 1) -> List[int]:
+        primes = []
+        for chunk in self.iter_extend(limit, workers):
+            primes.extend(chunk.tolist() if np is not None else chunk)
+        return primes
+
+class PrimeTable:
+    # общая для процесса таблица простых: любой limit <= self.limit отвечается срезом по bisect.
+    # Таблица не растет выше max_limit и выше того, что помещается в memory_limit (SIEVE_MEMORY_LIMIT)
+    def __init__(self, max_limit: int = None, eviction: str = None, memory_limit: int = None, workers: int = None):
+        max_limit = PRIME_TABLE_MAX_LIMIT if max_limit is None else max_limit
+        self.memory_limit = SIEVE_MEMORY_LIMIT if memory_limit is None else memory_limit
+        self.max_limit = min(max_limit, table_limit(self.memory_limit))
+        self.workers = SIEVE_WORKERS if workers is None else workers
+        self.eviction = eviction or PRIME_TABLE_EVICTION
+        if self.eviction not in ("truncate", "bypass"):
+            raise ValueError(f"Неизвестная политика вытеснения: {self.eviction}")
+        self.limit = 1
+        self.primes = array('q', [2])
+        self.sieve = SundaramSieve()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._grow_lock = threading.Lock()
+
+    def count(self, limit: int) -> Union[int, None]:
+        with self._lock:
+            if limit > self.limit:
+                return None
+            self.hits += 1
+            return bisect_right(self.primes, limit)
+
+    def _slice(self, limit: int) -> array:
+        return self.primes[:bisect_right(self.primes, limit)]
+
+    def get(self, limit: int) -> List[int]:
+        return self.get_array(limit).tolist()
+
+    def get_array(self, limit: int) -> array:
+        # array('q') передается между процессами одним блоком байт, без поэлементной сериализации списка
+        with self._lock:
+            if limit <= self.limit:
+                self.hits += 1
+                return self._slice(limit)
+            self.misses += 1
+
+        with self._grow_lock:
+            if limit <= self.max_limit:
+                self.grow(limit)
+                with self._lock:
+                    return self._slice(limit)
+
+            # truncate: таблица растет до max_limit, остаток досеивается отдельно; bypass: таблицу не трогаем
+            if self.eviction == "bypass":
+                return array('q', resheto_sundarama(limit))
+            self.grow(self.max_limit)
+            with self._lock:
+                primes = self._slice(self.max_limit)
+            n = (limit - 1) // 2
+            for chunk in iter_windows((self.max_limit - 1) // 2 + 1, n + 1, base_indices(n)):
+                append_primes(primes, chunk)
+            return primes
+
+    def grow(self, limit: int):
+        # вызывается под _grow_lock; досеивается только окно выше уже посчитанного.
+        # Простые выше self.limit читателям не видны: срезы берутся по bisect до limit <= self.limit
+        if limit <= self.limit:
+            return
+        workers = self.workers if limit - self.limit >= SIEVE_PARALLEL_THRESHOLD else 1
+        size = len(self.primes)
+        try:
+            for chunk in self.sieve.iter_extend(limit, workers):
+                with self._lock:
+                    append_primes(self.primes, chunk)
+        except BaseException:
+            with self._lock:
+                del self.primes[size:]
+            raise
+        with self._lock:
+            self.limit = limit
+
+prime_table = PrimeTable()
+
+# задачи для пула процессов сервера: у каждого процесса пула своя таблица prime_table
+def sieve_primes(limit: int) -> array:
+    return prime_table.get_array(limit)
+
+def sieve_range(lo: int, hi: int) -> array:
+    return array('q', resheto_sundarama_range(lo, hi))
+
+def sieve_stats() -> dict:
+    with prime_table._lock:
+        return {"hits": prime_table.hits, "misses": prime_table.misses, "limit": prime_table.limit,
+                "primes": len(prime_table.primes)}
+
+def with_stats(func, *args) -> tuple:
+    # задача пула вместе со статистикой prime_table: сервер кэширует ее и отдает в /metrics,
+    # не ставя отдельный запрос в очередь процесса решета
+    return func(*args), sieve_stats()
+
+def sieve_count(limit: int) -> int:
+    count = prime_table.count(limit)
+    if count is not None:
+        return count
+    return count_primes(limit)
@@ -0,0 +1,930 @@
+from typing import Union, List, Tuple, Set
+from array import array
+import atexit
+import copy
+import json
+import os
+import sqlite3
+import struct
+import threading
+import time
+
+from sundaram_results import ResultStore, RESULTS_MAX_BYTES, encode_result, decode_result
+
+DATA_DIR = os.environ.get("SUNDARAM_DATA_DIR", ".")
+STORAGE = os.environ.get("SUNDARAM_STORAGE", "json")
+USERS_DIR = os.environ.get("SUNDARAM_USERS_DIR", os.path.join(DATA_DIR, "users"))
+HISTORY_DIR = os.environ.get("SUNDARAM_HISTORY_DIR", os.path.join(DATA_DIR, "history"))
+DB_PATH = os.environ.get("SUNDARAM_DB_PATH", os.path.join(DATA_DIR, "sundaram.db"))
+REFRESH_INTERVAL = float(os.environ.get("SUNDARAM_USERS_REFRESH_INTERVAL", 1.0))
+WRITE_BEHIND = os.environ.get("SUNDARAM_WRITE_BEHIND", "1") == "1"
+FLUSH_INTERVAL = float(os.environ.get("SUNDARAM_FLUSH_INTERVAL", 0.05))
+FLUSH_BATCH_SIZE = int(os.environ.get("SUNDARAM_FLUSH_BATCH_SIZE", 256))
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+# запись индекса истории: смещение строки в .jsonl и время записи (unix)
+HISTORY_INDEX = struct.Struct("<QQ")
+
+class AlreadyExists(Exception):
+    # field - занятое поле: login или email
+    def __init__(self, field: str):
+        super().__init__(field)
+        self.field = field
+
+def detached(user):
+    # копия для обработчика с пустым набором присвоенных полей: save() запишет только поля, которые обработчик
+    # присвоил после загрузки (model_fields_set), поверх актуальной записи, а не всю устаревшую копию
+    return type(user).model_construct(_fields_set=set(), **copy.deepcopy(dict(user)))
+
+def dirty(user) -> Set[str]:
+    return user.model_fields_set - {"id"}
+
+def parse_time(value: str) -> int:
+    return int(time.mktime(time.strptime(value, TIME_FORMAT)))
+
+def history_entry(user_id: int, operation_type: str, details: str) -> dict:
+    return {
+        "user": user_id,
+        "time": time.strftime(TIME_FORMAT, time.localtime()),
+        "operation": operation_type,
+        "details": details
+    }
+
+class UserRepository:
+    # пользователи загружаются один раз при старте; поиск по id, логину, email и сессии - по словарям,
+    # запись сразу уходит на диск
+    def __init__(self, model, directory: str = None):
+        self.model = model
+        self.directory = directory or USERS_DIR
+        self.by_id = {}
+        self.by_login = {}
+        self.by_email = {}
+        self.by_session = {}
+        self._mtimes = {}
+        self._last_refresh = 0.0
+        self._version = 0
+        self._staged = {}
+        self._written = {}
+        self._lock = threading.RLock()
+
+    def path(self, user_id: int) -> str:
+        return os.path.join(self.directory, f"user_{user_id}.json")
+
+    def load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.refresh(force=True)
+
+    def refresh(self, force: bool = False):
+        # подхватываем файлы, созданные или измененные другими процессами. scandir, stat и чтение файлов -
+        # без блокировки: get()/sessions() ждут только обновления индексов
+        with self._lock:
+            if not force and time.monotonic() - self._last_refresh < REFRESH_INTERVAL:
+                return
+            self._last_refresh = time.monotonic()
+            known = dict(self._mtimes)
+        found = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                mtime = entry.stat().st_mtime_ns
+                if known.get(entry.path) == mtime:
+                    continue
+                with open(entry.path, 'r') as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                continue
+            try:
+                user = self.model(**data)
+            except ValueError:
+                # записи другого формата (например, от server.py) пропускаем
+                user = None
+            found.append((entry.path, mtime, user))
+        with self._lock:
+            for path, mtime, user in found:
+                # файл уже записан или перечитан этим процессом, или в индексе версия, которая еще не записана
+                if self._mtimes.get(path) != known.get(path):
+                    continue
+                if user is not None and self._staged.get(user.id, 0) > self._written.get(user.id, 0):
+                    continue
+                self._mtimes[path] = mtime
+                if user is not None:
+                    self._index(user)
+
+    def reload(self, user_id: int):
+        path = self.path(user_id)
+        with self._lock:
+            if not os.path.exists(path):
+                return None
+            with open(path, 'r') as f:
+                user = self.model(**json.load(f))
+            self._index(user)
+            self._mtimes[path] = os.stat(path).st_mtime_ns
+            return detached(user)
+
+    def _index(self, user):
+        old = self.by_id.get(user.id)
+        if old is not None:
+            self.by_login.pop(old.login, None)
+            self.by_email.pop(old.email, None)
+            self.by_session.pop(old.session_token, None)
+        self.by_id[user.id] = user
+        self.by_login[user.login] = user.id
+        self.by_email[user.email] = user.id
+        if user.session_token:
+            self.by_session[user.session_token] = user.id
+
+    def get(self, user_id: int):
+        with self._lock:
+            user = self.by_id.get(user_id)
+            return detached(user) if user is not None else None
+
+    def _find(self, index: dict, key: str):
+        with self._lock:
+            if key in index:
+                return self.get(index[key])
+        self.refresh()
+        with self._lock:
+            return self.get(index[key]) if key in index else None
+
+    def find_by_login(self, login: str):
+        return self._find(self.by_login, login)
+
+    def find_by_email(self, email: str):
+        return self._find(self.by_email, email)
+
+    def sessions(self) -> List[tuple]:
+        with self._lock:
+            return list(self.by_session.items())
+
+    def create(self, user):
+        # проверка уникальности и запись под одной блокировкой: одновременные регистрации не создадут дубликат;
+        # файлы других процессов подхватываются до нее, без блокировки.
+        # id по времени регистрации, при совпадении секунды берется следующий свободный
+        with self._lock:
+            known = user.login in self.by_login or user.email in self.by_email
+        if not known:
+            self.refresh()
+        with self._lock:
+            if user.login in self.by_login:
+                raise AlreadyExists("login")
+            if user.email in self.by_email:
+                raise AlreadyExists("email")
+            user_id = int(time.time())
+            while user_id in self.by_id or os.path.exists(self.path(user_id)):
+                user_id += 1
+            user.id = user_id
+            version = self._stage(user)
+        self._persist(user, version)
+
+    def merge(self, user):
+        # присвоенные обработчиком поля поверх последней версии; None - ничего не изменилось
+        stored = self.by_id.get(user.id)
+        if stored is None:
+            return user
+        fields = {name: copy.deepcopy(getattr(user, name)) for name in dirty(user)}
+        if all(getattr(stored, name) == value for name, value in fields.items()):
+            return None
+        return stored.model_copy(update=fields)
+
+    def save(self, user) -> bool:
+        # неизмененный пользователь не перезаписывается
+        with self._lock:
+            merged = self.merge(user)
+            if merged is None:
+                return False
+            version = self._stage(merged)
+        self._persist(merged, version)
+        return True
+
+    def write(self, user):
+        with self._lock:
+            version = self._stage(user)
+        self._persist(user, version)
+
+    def _stage(self, user) -> int:
+        # под блокировкой: индекс сразу отдает новую версию, номер версии упорядочивает замены файла
+        self._version += 1
+        self._staged[user.id] = self._version
+        self._index(user.model_copy(deep=True))
+        return self._version
+
+    def _persist(self, user, version: int):
+        # запись во временный файл и fsync - без блокировки, чтение индекса их не ждет; под блокировкой только
+        # атомарная замена: при сбое остается старая или новая версия целиком, а более старая версия,
+        # дописанная позже, не заменяет уже записанную новую. fsync до замены на любом пути (create, параметры,
+        # пакет): без него после сбоя питания на диске может оказаться переименование без данных - пустой файл
+        path = self.path(user.id)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(user.model_dump(), f)
+            f.flush()
+            os.fsync(f.fileno())
+        with self._lock:
+            if self._written.get(user.id, 0) > version:
+                os.remove(tmp_path)
+                return
+            os.replace(tmp_path, path)
+            self._written[user.id] = version
+            self._mtimes[path] = os.stat(path).st_mtime_ns
+
+    def close(self):
+        pass
+
+    def remember(self, user):
+        # только обновить индексы в памяти; на диск запись уйдет позже пакетом, до нее refresh() не заменит
+        # эту версию прочитанным файлом
+        with self._lock:
+            self._version += 1
+            self._staged[user.id] = self._version
+            self._index(user.model_copy(deep=True))
+
+    def add_saved_param(self, user_id: int, param: dict) -> Union[int, None]:
+        with self._lock:
+            user = self.get(user_id)
+            if any(p.get('name') == param['name'] for p in user.saved_params):
+                return None
+            user.saved_params = user.saved_params + [param]
+            merged = self.merge(user)
+            version = self._stage(merged)
+        self._persist(merged, version)
+        return len(merged.saved_params)
+
+    def delete_saved_param(self, user_id: int, name: str) -> Union[int, None]:
+        with self._lock:
+            user = self.get(user_id)
+            saved_params = [p for p in user.saved_params if p.get('name') != name]
+            if len(saved_params) == len(user.saved_params):
+                return None
+            user.saved_params = saved_params
+            merged = self.merge(user)
+            version = self._stage(merged)
+        self._persist(merged, version)
+        return len(saved_params)
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+class JsonStorage(UserRepository):
+    # файловое хранилище: users/user_<id>.json, history/history_<id>.jsonl (+ .idx), results/result_<limit>.bin
+    def __init__(self, model, data_dir: str = None):
+        super().__init__(model, os.path.join(data_dir, "users") if data_dir else USERS_DIR)
+        self.history_dir = os.path.join(data_dir, "history") if data_dir else HISTORY_DIR
+        self.results = ResultStore(os.path.join(data_dir, "results") if data_dir else None)
+        # журналы истории под своей блокировкой: дописывание и чтение истории не задерживают поиск пользователей
+        self._history_lock = threading.RLock()
+
+    def load(self):
+        super().load()
+        os.makedirs(self.history_dir, exist_ok=True)
+
+    def history_path(self, user_id: int) -> str:
+        return os.path.join(self.history_dir, f"history_{user_id}.jsonl")
+
+    def history_index_path(self, user_id: int) -> str:
+        return os.path.join(self.history_dir, f"history_{user_id}.idx")
+
+    def legacy_history_path(self, user_id: int) -> str:
+        return os.path.join(self.history_dir, f"history_{user_id}.json")
+
+    def _upgrade_history(self, user_id: int) -> bool:
+        # history_<id>.json старого формата переписывается в журнал при первом обращении
+        if os.path.exists(self.history_path(user_id)):
+            return True
+        legacy_file = self.legacy_history_path(user_id)
+        if not os.path.exists(legacy_file):
+            return False
+        with open(legacy_file, 'r') as f:
+            history = json.load(f)
+        self.init_history(user_id)
+        for entry in history:
+            self.append_history(user_id, entry)
+        os.remove(legacy_file)
+        return True
+
+    def init_history(self, user_id: int):
+        open(self.history_index_path(user_id), 'wb').close()
+        open(self.history_path(user_id), 'wb').close()
+
+    def append_history(self, user_id: int, entry: dict):
+        self._append_history(user_id, [entry])
+
+    def _append_history(self, user_id: int, entries: List[dict], sync: bool = False):
+        with self._history_lock:
+            if not self._upgrade_history(user_id):
+                return
+        lines = [(json.dumps(entry) + "\n").encode() for entry in entries]
+        with open(self.history_path(user_id), 'ab') as log, open(self.history_index_path(user_id), 'ab') as index:
+            # под блокировкой только дописывание: смещения строк должны совпасть с индексом; fsync - после нее
+            with self._history_lock:
+                offset = log.seek(0, os.SEEK_END)
+                records = []
+                for entry, line in zip(entries, lines):
+                    records.append(HISTORY_INDEX.pack(offset, parse_time(entry['time'])))
+                    offset += len(line)
+                log.write(b"".join(lines))
+                index.write(b"".join(records))
+                log.flush()
+                index.flush()
+            if sync:
+                os.fsync(log.fileno())
+                os.fsync(index.fileno())
+
+    def write_batch(self, users: list, history: List[tuple]):
+        # групповая запись: каждый затронутый файл пишется и синхронизируется с диском один раз за пакет.
+        # Пакет уже содержит только измененных пользователей; пишется последняя версия из индекса,
+        # в которую remember() уже слил сохранения, поступившие после формирования пакета
+        for user in users:
+            with self._lock:
+                latest = self.by_id.get(user.id, user)
+            self.write(latest)
+        by_user = {}
+        for user_id, entry in history:
+            by_user.setdefault(user_id, []).append(entry)
+        for user_id, entries in by_user.items():
+            self._append_history(user_id, entries, sync=True)
+
+    def _bisect_time(self, index, count: int, ts: int) -> int:
+        # первая запись со временем >= ts; записи дописываются по времени, поэтому индекс упорядочен
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            index.seek(mid * HISTORY_INDEX.size)
+            if HISTORY_INDEX.unpack(index.read(HISTORY_INDEX.size))[1] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def get_history(self, user_id: int, cursor: int = 0, limit: int = None,
+                    since: str = None, until: str = None) -> Tuple[List[dict], Union[int, None]]:
+        with self._history_lock:
+            if not self._upgrade_history(user_id):
+                return [], None
+
+            with open(self.history_index_path(user_id), 'rb') as index, open(self.history_path(user_id), 'rb') as log:
+                count = os.fstat(index.fileno()).st_size // HISTORY_INDEX.size
+                start = max(cursor or 0, self._bisect_time(index, count, parse_time(since)) if since else 0)
+                end = self._bisect_time(index, count, parse_time(until) + 1) if until else count
+                stop = min(end, start + limit) if limit is not None else end
+                if start >= stop:
+                    return [], None
+
+                index.seek(start * HISTORY_INDEX.size)
+                offset = HISTORY_INDEX.unpack(index.read(HISTORY_INDEX.size))[0]
+                if stop < count:
+                    index.seek(stop * HISTORY_INDEX.size)
+                    size = HISTORY_INDEX.unpack(index.read(HISTORY_INDEX.size))[0] - offset
+                else:
+                    size = -1
+                log.seek(offset)
+                history = [json.loads(line) for line in log.read(size).splitlines()]
+
+        return history, (stop if stop < end else None)
+
+    def read_history(self, user_id: int) -> List[dict]:
+        # вся история только чтением: старый history_<id>.json не переводится в журнал (для переноса данных)
+        with self._history_lock:
+            if os.path.exists(self.history_path(user_id)):
+                with open(self.history_path(user_id), 'r') as log:
+                    return [json.loads(line) for line in log]
+            if os.path.exists(self.legacy_history_path(user_id)):
+                with open(self.legacy_history_path(user_id), 'r') as f:
+                    return json.load(f)
+            return []
+
+    def clear_history(self, user_id: int):
+        with self._history_lock:
+            if self._upgrade_history(user_id):
+                self.init_history(user_id)
+
+    def put_result(self, limit: int, primes: List[int]):
+        self.results.put(limit, primes)
+
+    def get_result(self, limit: int) -> Union[array, None]:
+        return self.results.get(limit)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    login TEXT NOT NULL UNIQUE,
+    email TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL,
+    technical_token TEXT,
+    session_token TEXT,
+    sundaram_params TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS users_session_token ON users (session_token);
+CREATE TABLE IF NOT EXISTS saved_params (
+    user_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    "limit" INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    PRIMARY KEY (user_id, name)
+);
+CREATE TABLE IF NOT EXISTS results (
+    "limit" INTEGER PRIMARY KEY,
+    count INTEGER NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS result_usage (
+    "limit" INTEGER PRIMARY KEY,
+    size INTEGER NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    time TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    details TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_user_id ON history (user_id, id);
+CREATE INDEX IF NOT EXISTS history_user_time ON history (user_id, time);
+"""
+
+USER_COLUMNS = "id, login, email, password, technical_token, session_token, sundaram_params"
+USER_FIELDS = ("login", "email", "password", "technical_token", "session_token", "sundaram_params")
+
+class SqliteStorage:
+    # одна база в режиме WAL на все процессы; у каждого потока свое соединение
+    def __init__(self, model, path: str = None):
+        self.model = model
+        self.path = path or DB_PATH
+        self.results_max_bytes = RESULTS_MAX_BYTES
+        self._local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = self.connection()
+        conn.executescript(SCHEMA)
+        # результаты из баз без result_usage считаются самыми старыми
+        conn.execute('INSERT OR IGNORE INTO result_usage ("limit", size, used_at) '
+                     'SELECT "limit", length(data), 0 FROM results')
+
+    def refresh(self, force: bool = False):
+        pass
+
+    def _user(self, row):
+        if row is None:
+            return None
+        conn = self.connection()
+        saved_params = [
+            {"name": name, "limit": limit, "created_at": created_at}
+            for name, limit, created_at in conn.execute(
+                'SELECT name, "limit", created_at FROM saved_params WHERE user_id = ? ORDER BY rowid', (row[0],))
+        ]
+        return self.model.model_construct(
+            _fields_set=set(), id=row[0], login=row[1], email=row[2], password=row[3], technical_token=row[4],
+            session_token=row[5], sundaram_params=json.loads(row[6]), saved_params=saved_params)
+
+    def get(self, user_id: int):
+        return self._user(self.connection().execute(
+            f"SELECT {USER_COLUMNS} FROM users WHERE id = ?", (user_id,)).fetchone())
+
+    def reload(self, user_id: int):
+        return self.get(user_id)
+
+    def find_by_login(self, login: str):
+        return self._user(self.connection().execute(
+            f"SELECT {USER_COLUMNS} FROM users WHERE login = ?", (login,)).fetchone())
+
+    def find_by_email(self, email: str):
+        return self._user(self.connection().execute(
+            f"SELECT {USER_COLUMNS} FROM users WHERE email = ?", (email,)).fetchone())
+
+    def sessions(self) -> List[tuple]:
+        return self.connection().execute(
+            "SELECT session_token, id FROM users WHERE session_token IS NOT NULL").fetchall()
+
+    def create(self, user):
+        conn = self.connection()
+        # BEGIN IMMEDIATE держит блокировку записи всех процессов: проверка уникальности и вставка атомарны
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for field in ("login", "email"):
+                if conn.execute(f"SELECT 1 FROM users WHERE {field} = ?", (getattr(user, field),)).fetchone():
+                    raise AlreadyExists(field)
+            max_id = conn.execute("SELECT MAX(id) FROM users").fetchone()[0] or 0
+            user.id = max(int(time.time()), max_id + 1)
+            conn.execute(f"INSERT INTO users ({USER_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (user.id, user.login, user.email, user.password, user.technical_token,
+                          user.session_token, json.dumps(user.sundaram_params)))
+            for param in user.saved_params:
+                self._insert_param(conn, user.id, param)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def save(self, user) -> bool:
+        # обновляются только присвоенные обработчиком столбцы, остальные остаются такими, как в базе;
+        # строка без изменений не переписывается. Сохраненные параметры обычно меняются отдельными запросами,
+        # а из очереди записи (WriteBehindStorage) приходят списком и сверяются с таблицей по именам
+        fields = [name for name in USER_FIELDS if name in dirty(user)]
+        params = "saved_params" in dirty(user)
+        if not fields and not params:
+            return False
+        conn = self.connection()
+        own = params and not conn.in_transaction
+        if own:
+            conn.execute("BEGIN IMMEDIATE")
+        try:
+            changed = False
+            if fields:
+                values = [json.dumps(user.sundaram_params) if name == "sundaram_params" else getattr(user, name)
+                          for name in fields]
+                changed = conn.execute(
+                    f"UPDATE users SET {', '.join(f'{name} = ?' for name in fields)} "
+                    f"WHERE id = ? AND ({' OR '.join(f'{name} IS NOT ?' for name in fields)})",
+                    (*values, user.id, *values)).rowcount > 0
+            if params:
+                changed = self._save_params(conn, user) or changed
+            if own:
+                conn.execute("COMMIT")
+        except BaseException:
+            if own:
+                conn.execute("ROLLBACK")
+            raise
+        return changed
+
+    def _save_params(self, conn, user) -> bool:
+        stored = {row[0] for row in conn.execute("SELECT name FROM saved_params WHERE user_id = ?", (user.id,))}
+        names = {param['name'] for param in user.saved_params}
+        for name in stored - names:
+            conn.execute("DELETE FROM saved_params WHERE user_id = ? AND name = ?", (user.id, name))
+        for param in user.saved_params:
+            if param['name'] not in stored:
+                self._insert_param(conn, user.id, param)
+        return stored != names
+
+    def _insert_param(self, conn, user_id: int, param: dict):
+        conn.execute('INSERT INTO saved_params (user_id, name, "limit", created_at) VALUES (?, ?, ?, ?)',
+                     (user_id, param['name'], param['limit'], param['created_at']))
+
+    def add_saved_param(self, user_id: int, param: dict) -> Union[int, None]:
+        conn = self.connection()
+        try:
+            self._insert_param(conn, user_id, param)
+        except sqlite3.IntegrityError:
+            return None
+        return conn.execute("SELECT COUNT(*) FROM saved_params WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+    def delete_saved_param(self, user_id: int, name: str) -> Union[int, None]:
+        conn = self.connection()
+        if conn.execute("DELETE FROM saved_params WHERE user_id = ? AND name = ?", (user_id, name)).rowcount == 0:
+            return None
+        return conn.execute("SELECT COUNT(*) FROM saved_params WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+    def init_history(self, user_id: int):
+        pass
+
+    def remember(self, user):
+        pass
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def write_batch(self, users: list, history: List[tuple]):
+        # один транзакционный коммит на весь пакет
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for user in users:
+                self.save(user)
+            conn.executemany(
+                "INSERT INTO history (user_id, time, operation, details) VALUES (?, ?, ?, ?)",
+                [(user_id, entry['time'], entry['operation'], entry['details']) for user_id, entry in history])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def append_history(self, user_id: int, entry: dict):
+        self.connection().execute(
+            "INSERT INTO history (user_id, time, operation, details) VALUES (?, ?, ?, ?)",
+            (user_id, entry['time'], entry['operation'], entry['details']))
+
+    def get_history(self, user_id: int, cursor: int = 0, limit: int = None,
+                    since: str = None, until: str = None) -> Tuple[List[dict], Union[int, None]]:
+        # курсор - id последней выданной записи; время в формате TIME_FORMAT сравнивается как строка
+        query = "SELECT id, time, operation, details FROM history WHERE user_id = ? AND id > ?"
+        args = [user_id, cursor or 0]
+        if since:
+            query += " AND time >= ?"
+            args.append(since)
+        if until:
+            query += " AND time <= ?"
+            args.append(until)
+        query += " ORDER BY id"
+        if limit is not None:
+            query += " LIMIT ?"
+            args.append(limit + 1)
+
+        rows = self.connection().execute(query, args).fetchall()
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1][0]
+        return [{"user": user_id, "time": row[1], "operation": row[2], "details": row[3]} for row in rows], next_cursor
+
+    def clear_history(self, user_id: int):
+        self.connection().execute("DELETE FROM history WHERE user_id = ?", (user_id,))
+
+    def put_result(self, limit: int, primes: List[int]):
+        data = encode_result(primes)
+        if len(data) > self.results_max_bytes:
+            return
+        conn = self.connection()
+        # внутри уже открытой транзакции (перенос данных) своя не начинается
+        own = not conn.in_transaction
+        if own:
+            conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute('INSERT OR IGNORE INTO results ("limit", count, data) VALUES (?, ?, ?)',
+                            (limit, len(primes), data)).rowcount:
+                conn.execute('INSERT OR REPLACE INTO result_usage ("limit", size, used_at) VALUES (?, ?, ?)',
+                             (limit, len(data), time.time()))
+                self._evict_results(conn)
+            if own:
+                conn.execute("COMMIT")
+        except BaseException:
+            if own:
+                conn.execute("ROLLBACK")
+            raise
+
+    def _evict_results(self, conn: sqlite3.Connection):
+        # самые давно читавшиеся результаты удаляются, пока все не поместятся в results_max_bytes
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM result_usage").fetchone()[0]
+        if total <= self.results_max_bytes:
+            return
+        for limit, size in conn.execute('SELECT "limit", size FROM result_usage ORDER BY used_at').fetchall():
+            if total <= self.results_max_bytes:
+                break
+            conn.execute('DELETE FROM results WHERE "limit" = ?', (limit,))
+            conn.execute('DELETE FROM result_usage WHERE "limit" = ?', (limit,))
+            total -= size
+
+    def get_result(self, limit: int) -> Union[array, None]:
+        conn = self.connection()
+        row = conn.execute('SELECT data FROM results WHERE "limit" = ?', (limit,)).fetchone()
+        if row is None:
+            return None
+        conn.execute('UPDATE result_usage SET used_at = ? WHERE "limit" = ?', (time.time(), limit))
+        return decode_result(row[0])
+
+    def __len__(self) -> int:
+        return self.connection().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+class WriteBehindStorage:
+    # сохранения пользователей и записи истории копятся в очереди и пишутся фоновым потоком пакетами:
+    # по таймеру FLUSH_INTERVAL или при накоплении FLUSH_BATCH_SIZE операций
+    def __init__(self, storage, interval: float = None, batch_size: int = None):
+        self.storage = storage
+        self.interval = FLUSH_INTERVAL if interval is None else interval
+        self.batch_size = batch_size or FLUSH_BATCH_SIZE
+        self._users = {}
+        self._history = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        # записи истории в начале очереди, которые сейчас пишет flush(); счетчики начатых и завершенных сбросов
+        self._inflight = 0
+        self._started = 0
+        self._done = 0
+        self._wanted = 0
+        self._closing = False
+        self._thread = None
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def __len__(self) -> int:
+        return len(self.storage)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sundaram-write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if (not self._closing and self._done >= self._wanted
+                        and len(self._users) + len(self._history) < self.batch_size):
+                    self._cond.wait(self.interval)
+                closing = self._closing
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Ошибка фоновой записи: {e}")
+            if closing:
+                return
+
+    def flush(self):
+        # пакет остается в очереди, пока не записан: чтение и слияние новых сохранений видят его и во время записи;
+        # при ошибке он будет записан следующим сбросом
+        with self._flush_lock:
+            with self._cond:
+                users = dict(self._users)
+                history = list(self._history)
+                if not users and not history:
+                    return
+                self._inflight = len(history)
+                self._started += 1
+            try:
+                self.storage.write_batch(list(users.values()), history)
+            except BaseException:
+                with self._cond:
+                    self._inflight = 0
+                    self._cond.notify_all()
+                raise
+            with self._cond:
+                for user_id, user in users.items():
+                    if self._users.get(user_id) is user:
+                        del self._users[user_id]
+                del self._history[:len(history)]
+                self._inflight = 0
+                self._done = self._started
+                self._cond.notify_all()
+
+    def _wait_inflight(self, user_id: int):
+        # под self._cond: дождаться, пока идущий сброс допишет записи истории пользователя в хранилище
+        while any(item[0] == user_id for item in self._history[:self._inflight]):
+            self._cond.wait()
+
+    def _wait_written(self):
+        # дождаться фоновой записи всего, что сейчас в очереди: пишет фоновый поток, а не запрос
+        if self._thread is None:
+            self.flush()
+            return
+        with self._cond:
+            target = self._started + 1
+            self._wanted = max(self._wanted, target)
+            self._cond.notify_all()
+            while self._done < target and not self._closing:
+                self._cond.wait()
+
+    def close(self):
+        with self._cond:
+            if self._closing:
+                return
+            self._closing = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _pending(self, user):
+        if user is None:
+            return None
+        with self._cond:
+            pending = self._users.get(user.id)
+        return detached(pending) if pending is not None else user
+
+    def get(self, user_id: int):
+        with self._cond:
+            pending = self._users.get(user_id)
+        if pending is not None:
+            return detached(pending)
+        return self.storage.get(user_id)
+
+    def reload(self, user_id: int):
+        return self._pending(self.storage.reload(user_id))
+
+    def find_by_login(self, login: str):
+        return self._pending(self.storage.find_by_login(login))
+
+    def find_by_email(self, email: str):
+        return self._pending(self.storage.find_by_email(email))
+
+    def sessions(self) -> List[tuple]:
+        with self._cond:
+            pending = {user.id: user.session_token for user in self._users.values()}
+        sessions = [(token, user_id) for token, user_id in self.storage.sessions() if user_id not in pending]
+        return sessions + [(token, user_id) for user_id, token in pending.items() if token is not None]
+
+    def refresh(self, force: bool = False):
+        # без сброса очереди: remember() уже держит ожидающие записи пользователей в индексе,
+        # а неверная подпись не должна вызывать групповую запись с fsync внутри запроса
+        self.storage.refresh(force)
+
+    def save(self, user) -> bool:
+        # повторные сохранения одного пользователя до сброса очереди сливаются в одну запись:
+        # присвоенные поля ложатся поверх версии в очереди, набор присвоенных полей копится
+        # (model_fields_set), и хранилище при записи пакета обновляет только их
+        fields = {name: copy.deepcopy(getattr(user, name)) for name in dirty(user)}
+
+        def change(base):
+            if all(getattr(base, name) == value for name, value in fields.items()):
+                return None
+            for name, value in fields.items():
+                setattr(base, name, value)
+            return True
+
+        return self._update(user.id, change) is not None
+
+    def _update(self, user_id: int, change):
+        # change(base) меняет версию из очереди (или сохраненную) и возвращает результат; None - без изменений
+        with self._save_lock:
+            with self._cond:
+                pending = self._users.get(user_id)
+            base = pending.model_copy(deep=True) if pending is not None else self.storage.get(user_id)
+            if base is None:
+                return None
+            result = change(base)
+            if result is None:
+                return None
+            self.storage.remember(base)
+            with self._cond:
+                self._users[user_id] = base
+                if len(self._users) + len(self._history) >= self.batch_size:
+                    self._cond.notify()
+        return result
+
+    def append_history(self, user_id: int, entry: dict):
+        with self._cond:
+            self._history.append((user_id, entry))
+            if len(self._users) + len(self._history) >= self.batch_size:
+                self._cond.notify()
+
+    # операции, которые читают или переписывают сохраненное состояние, сначала сбрасывают очередь
+    def add_saved_param(self, user_id: int, param: dict) -> Union[int, None]:
+        # параметры меняются в версии пользователя из очереди и пишутся вместе с пакетом
+        def change(user):
+            if any(p.get('name') == param['name'] for p in user.saved_params):
+                return None
+            user.saved_params = user.saved_params + [param]
+            return len(user.saved_params)
+
+        return self._update(user_id, change)
+
+    def delete_saved_param(self, user_id: int, name: str) -> Union[int, None]:
+        def change(user):
+            saved_params = [p for p in user.saved_params if p.get('name') != name]
+            if len(saved_params) == len(user.saved_params):
+                return None
+            user.saved_params = saved_params
+            return len(saved_params)
+
+        return self._update(user_id, change)
+
+    def get_history(self, user_id: int, cursor: int = 0, limit: int = None,
+                    since: str = None, until: str = None) -> Tuple[List[dict], Union[int, None]]:
+        # ожидающие записи пользователя дописываются к последней странице из хранилища. Если сброс начался
+        # во время чтения, страница читается заново; если записи очереди не помещаются в страницу, курсор на них
+        # дать нельзя - запрос ждет, пока фоновый поток их запишет
+        while True:
+            with self._cond:
+                self._wait_inflight(user_id)
+                started = self._started
+                pending = [entry for item_user, entry in self._history if item_user == user_id]
+            history, next_cursor = self.storage.get_history(user_id, cursor, limit, since, until)
+            with self._cond:
+                if self._started == started or not pending:
+                    break
+        if next_cursor is not None or not pending:
+            return history, next_cursor
+
+        if since:
+            pending = [entry for entry in pending if parse_time(entry['time']) >= parse_time(since)]
+        if until:
+            pending = [entry for entry in pending if parse_time(entry['time']) <= parse_time(until)]
+        if limit is None or len(history) + len(pending) <= limit:
+            return history + pending, None
+        self._wait_written()
+        return self.storage.get_history(user_id, cursor, limit, since, until)
+
+    def clear_history(self, user_id: int):
+        # записи пользователя из очереди отбрасываются; записи, которые уже пишутся, сначала дописываются
+        with self._cond:
+            self._wait_inflight(user_id)
+            self._history[self._inflight:] = [item for item in self._history[self._inflight:] if item[0] != user_id]
+        self.storage.clear_history(user_id)
+
+def open_storage(model, kind: str = None, write_behind: bool = None):
+    kind = kind or STORAGE
+    if kind == "json":
+        storage = JsonStorage(model)
+    elif kind == "sqlite":
+        storage = SqliteStorage(model)
+    else:
+        raise ValueError(f"Неизвестное хранилище: {kind}")
+    storage.load()
+
+    if WRITE_BEHIND if write_behind is None else write_behind:
+        storage = WriteBehindStorage(storage)
+        storage.start()
+    return storage
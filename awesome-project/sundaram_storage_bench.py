@@ -0,0 +1,172 @@
+from typing import List, Dict
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import sundaram_server as server
+
+STORAGE_BENCH_SIZES = os.environ.get("SUNDARAM_STORAGE_BENCH_SIZES", "1000,10000,100000")
+STORAGE_BENCH_SAMPLES = int(os.environ.get("SUNDARAM_STORAGE_BENCH_SAMPLES", 200))
+LIMITS = [10, 100, 1000, 10_000, 100_000, 1_000_000]
+OPERATIONS = ["get_user_by_token", "get_user_by_token_legacy", "auth_user", "create_user", "save_history"]
+
+def synthetic_users(model, count: int, history_mean: int, rng: random.Random, first_id: int = 1_000_000):
+    # пользователи как у живого сервиса: ссылка на текущий результат, несколько сохраненных параметров, история
+    for i in range(count):
+        user_id = first_id + i
+        limit = rng.choice(LIMITS)
+        user = model(
+            id=user_id, login=f"bench_{user_id}", email=f"bench_{user_id}@bench.test", password="Bench123!@#",
+            technical_token=str(rng.getrandbits(128)),
+            session_token=hashlib.sha256(f"{user_id}{rng.random()}".encode()).hexdigest(),
+            sundaram_params={"limit": limit, "count": limit // 10},
+            saved_params=[{"name": f"p{j}", "limit": rng.choice(LIMITS), "created_at": "2026-01-01 12:00:00"}
+                          for j in range(rng.randint(0, 5))])
+        history = [{"user": user_id, "time": f"2026-01-01 12:{j // 60 % 60:02d}:{j % 60:02d}",
+                    "operation": "sundaram_generate", "details": f"Сгенерировано простых чисел до {limit}"}
+                   for j in range(int(rng.expovariate(1 / history_mean)) if history_mean else 0)]
+        yield user, history
+
+def seed(storage, users) -> int:
+    # напрямую через слой хранения: create() подбирает id по времени и для 100k записей был бы слишком медленным
+    from sundaram_storage import JsonStorage
+    total = 0
+    if isinstance(storage, JsonStorage):
+        for user, history in users:
+            storage.write(user)
+            storage.init_history(user.id)
+            if history:
+                storage._append_history(user.id, history)
+            total += 1
+        return total
+
+    conn = storage.connection()
+    conn.execute("BEGIN")
+    for user, history in users:
+        conn.execute("INSERT INTO users (id, login, email, password, technical_token, session_token, sundaram_params) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     (user.id, user.login, user.email, user.password, user.technical_token, user.session_token,
+                      json.dumps(user.sundaram_params)))
+        for param in user.saved_params:
+            storage._insert_param(conn, user.id, param)
+        conn.executemany("INSERT INTO history (user_id, time, operation, details) VALUES (?, ?, ?, ?)",
+                         [(user.id, entry["time"], entry["operation"], entry["details"]) for entry in history])
+        total += 1
+    conn.execute("COMMIT")
+    return total
+
+def make_request(headers: Dict[str, str]):
+    from starlette.requests import Request
+    return Request({"type": "http", "method": "GET", "path": "/", "query_string": b"",
+                    "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()]})
+
+def summarize(samples: List[float]) -> dict:
+    samples = sorted(samples)
+    return {
+        "samples": len(samples),
+        "mean_us": sum(samples) / len(samples) * 1e6,
+        "p50_us": samples[len(samples) // 2] * 1e6,
+        "p95_us": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1e6,
+    }
+
+def bench_size(server, kind: str, size: int, samples: int, history_mean: int, rng: random.Random) -> dict:
+    from sundaram_storage import JsonStorage, SqliteStorage
+    from sundaram_client import Signer
+
+    data_dir = tempfile.mkdtemp(prefix=f"sundaram_storage_bench_{kind}_{size}_")
+    try:
+        if kind == "json":
+            storage = JsonStorage(server.User, data_dir)
+        else:
+            storage = SqliteStorage(server.User, os.path.join(data_dir, "sundaram.db"))
+        storage.load()
+        start = time.perf_counter()
+        seed(storage, synthetic_users(server.User, size, history_mean, rng))
+        seed_time = time.perf_counter() - start
+
+        # холодный старт: новый процесс сервера заново индексирует users/
+        if kind == "json":
+            storage = JsonStorage(server.User, data_dir)
+        else:
+            storage = SqliteStorage(server.User, os.path.join(data_dir, "sundaram.db"))
+        start = time.perf_counter()
+        storage.load()
+        load_time = time.perf_counter() - start
+        server.storage = storage
+
+        ids = [1_000_000 + rng.randrange(size) for _ in range(samples)]
+        timings = {operation: [] for operation in OPERATIONS}
+        for i, user_id in enumerate(ids):
+            user = storage.get(user_id)
+            client = Signer()
+            client.session_token = user.session_token
+            client.user_id = user_id
+
+            request = make_request(client.auth_headers(None))
+            start = time.perf_counter()
+            server.get_user_by_token(request, None)
+            timings["get_user_by_token"].append(time.perf_counter() - start)
+
+            headers = client.auth_headers(None)
+            headers.pop("X-User-Id")
+            request = make_request(headers)
+            start = time.perf_counter()
+            server.get_user_by_token(request, None)
+            timings["get_user_by_token_legacy"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            server.authenticate_user(server.AuthUser(login=user.login, password=user.password))
+            timings["auth_user"].append(time.perf_counter() - start)
+
+            new_user = server.User(login=f"new_{size}_{i}", email=f"new_{size}_{i}@bench.test", password="Bench123!@#")
+            start = time.perf_counter()
+            server.register_user(new_user)
+            timings["create_user"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            server.save_history(user_id, "bench", "Замер записи истории")
+            timings["save_history"].append(time.perf_counter() - start)
+
+        storage.close()
+        return {"storage": kind, "users": size, "seed_time": seed_time, "load_time": load_time,
+                "operations": {operation: summarize(values) for operation, values in timings.items()}}
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+def print_result(result: dict):
+    print(f"\n{result['storage']}, пользователей: {result['users']} "
+          f"(заполнение {result['seed_time']:.1f} с, загрузка {result['load_time'] * 1000:.1f} мс)")
+    print(f"  {'операция':26} {'среднее, мкс':>13} {'p50, мкс':>10} {'p95, мкс':>10}")
+    for operation, row in result["operations"].items():
+        print(f"  {operation:26} {row['mean_us']:>13.1f} {row['p50_us']:>10.1f} {row['p95_us']:>10.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер операций хранилища в зависимости от числа пользователей")
+    parser.add_argument("--sizes", default=STORAGE_BENCH_SIZES, help="размеры базы через запятую")
+    parser.add_argument("--storage", default="json,sqlite", help="хранилища через запятую: json, sqlite")
+    parser.add_argument("--samples", type=int, default=STORAGE_BENCH_SAMPLES, help="замеров каждой операции")
+    parser.add_argument("--history", type=int, default=20, help="средняя длина истории пользователя")
+    parser.add_argument("--seed", type=int, default=1, help="начальное значение генератора случайных чисел")
+    parser.add_argument("--json", help="записать результаты в JSON-файл")
+    args = parser.parse_args()
+
+    # замеряется хранилище без очереди отложенной записи: стоимость самой записи, а не постановки в очередь
+    rng = random.Random(args.seed)
+    results = []
+    for kind in [kind.strip() for kind in args.storage.split(",") if kind.strip()]:
+        for size in [int(size) for size in args.sizes.split(",")]:
+            result = bench_size(server, kind, size, args.samples, args.history, rng)
+            print_result(result)
+            results.append(result)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
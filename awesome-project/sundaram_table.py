@@ -0,0 +1,173 @@
+from typing import List, Union
+from array import array
+import argparse
+import mmap
+import os
+import struct
+import time
+
+from sundaram_sieve import np, base_indices, sieve_window
+
+# Формат файла таблицы:
+#   заголовок HEADER (magic, версия, байт в блоке, limit, n, число блоков, смещение данных)
+#   индекс: (blocks + 1) накопленных счетчиков uint64 - сколько нечетных простых до начала блока
+#   данные: бит k (порядок битов little) равен 1, если 2k + 1 простое, k = 0..n
+MAGIC = b"SUNDTBL1"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQQQQ")
+BLOCK_BYTES = 4096
+WINDOW_BLOCKS = 256
+
+PRIME_TABLE_PATH = os.environ.get("SUNDARAM_PRIME_TABLE_PATH", "primes.tbl")
+
+BYTE_BITS = [[bit for bit in range(8) if byte >> bit & 1] for byte in range(256)]
+
+def build_table(path: str, limit: int, block_bytes: int = BLOCK_BYTES) -> int:
+    if np is None:
+        raise RuntimeError("Для построения таблицы нужен numpy")
+    if limit < 2:
+        raise ValueError("Верхняя граница должна быть не меньше 2")
+
+    n = (limit - 1) // 2
+    block_bits = block_bytes * 8
+    blocks = -(-(n + 1) // block_bits)
+    index_offset = HEADER.size
+    data_offset = index_offset + 8 * (blocks + 1)
+
+    bases = base_indices(n)
+    counts = np.zeros(blocks + 1, dtype=np.uint64)
+    window = block_bits * WINDOW_BLOCKS
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, block_bytes, limit, n, blocks, data_offset))
+        f.write(counts.tobytes())
+
+        block = 0
+        for lo in range(0, blocks * block_bits, window):
+            hi = min(lo + window, blocks * block_bits)
+            reshet = sieve_window(lo, min(hi, n + 1), bases)
+            if len(reshet) < hi - lo:
+                reshet = np.concatenate((reshet, np.zeros(hi - lo - len(reshet), dtype=np.uint8)))
+            per_block = reshet.reshape(-1, block_bits).sum(axis=1, dtype=np.uint64)
+            counts[block + 1:block + 1 + len(per_block)] = per_block
+            block += len(per_block)
+            f.write(np.packbits(reshet, bitorder='little').tobytes())
+
+        f.seek(index_offset)
+        f.write(np.cumsum(counts, dtype=np.uint64).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+class PrimeTableFile:
+    # таблица, отображенная в память: все воркеры читают одну копию из page cache
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.block_bytes, self.limit, self.n, self.blocks, self.data_offset = \
+            HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mmap.close()
+            raise ValueError(f"Неверный формат таблицы простых чисел: {path}")
+
+        view = memoryview(self._mmap)
+        self.counts = view[HEADER.size:HEADER.size + 8 * (self.blocks + 1)].cast('Q')
+        self.bits = view[self.data_offset:self.data_offset + self.blocks * self.block_bytes]
+
+    def primes(self, limit: int) -> List[int]:
+        return self.primes_between(0, limit)
+
+    def primes_between(self, lo: int, hi: int) -> List[int]:
+        if hi > self.limit:
+            raise ValueError(f"Таблица построена только до {self.limit}")
+        if hi < 2 or hi < lo:
+            return []
+
+        primes = [2] if lo <= 2 else []
+        k_lo = max(1, lo // 2)
+        n = (hi - 1) // 2
+        if n < k_lo:
+            return primes
+        first, last = k_lo // 8, n // 8
+
+        if np is not None:
+            return primes + self._odd_primes(k_lo, n).tolist()
+
+        for pos in range(first, last + 1):
+            for bit in BYTE_BITS[self.bits[pos]]:
+                k = 8 * pos + bit
+                if k_lo <= k <= n:
+                    primes.append(2 * k + 1)
+        return primes
+
+    def _odd_primes(self, k_lo: int, n: int):
+        first, last = k_lo // 8, n // 8
+        bits = np.frombuffer(self.bits, dtype=np.uint8, count=last - first + 1, offset=first)
+        marks = np.unpackbits(bits, bitorder='little')[k_lo - 8 * first:n - 8 * first + 1]
+        return 2 * (np.flatnonzero(marks) + k_lo) + 1
+
+    def primes_array(self, lo: int, hi: int) -> array:
+        # как primes_between, но массивом array('q'): без списка Python, который строится под GIL
+        if np is None or hi < 3 or hi < lo:
+            return array('q', self.primes_between(lo, hi))
+        if hi > self.limit:
+            raise ValueError(f"Таблица построена только до {self.limit}")
+
+        primes = array('q', [2] if lo <= 2 else [])
+        k_lo = max(1, lo // 2)
+        n = (hi - 1) // 2
+        if n >= k_lo:
+            primes.frombytes(self._odd_primes(k_lo, n).astype(np.int64, copy=False).tobytes())
+        return primes
+
+    def count(self, limit: int) -> int:
+        # накопленный счетчик блока плюс popcount неполного хвоста блока
+        if limit > self.limit:
+            raise ValueError(f"Таблица построена только до {self.limit}")
+        if limit < 2:
+            return 0
+
+        n = (limit - 1) // 2
+        block_bits = self.block_bytes * 8
+        block = n // block_bits
+        start = block * self.block_bytes
+        full, rest = divmod(n - block * block_bits + 1, 8)
+
+        count = 1 + self.counts[block]
+        if np is not None:
+            count += int(np.unpackbits(np.frombuffer(self.bits, dtype=np.uint8, count=full, offset=start)).sum())
+        else:
+            count += sum(len(BYTE_BITS[byte]) for byte in self.bits[start:start + full])
+        if rest:
+            count += len([bit for bit in BYTE_BITS[self.bits[start + full]] if bit < rest])
+        return count
+
+    def close(self):
+        self.counts.release()
+        self.bits.release()
+        self._mmap.close()
+
+def open_table(path: str = None) -> Union[PrimeTableFile, None]:
+    path = path or PRIME_TABLE_PATH
+    if not os.path.exists(path):
+        return None
+    return PrimeTableFile(path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Построение файла таблицы простых чисел для sundaram_server")
+    parser.add_argument("limit", type=int, help="верхняя граница таблицы")
+    parser.add_argument("-o", "--output", default=PRIME_TABLE_PATH, help="путь к файлу таблицы")
+    parser.add_argument("--block-bytes", type=int, default=BLOCK_BYTES, help="размер блока индекса в байтах")
+    args = parser.parse_args()
+
+    start = time.time()
+    size = build_table(args.output, args.limit, args.block_bytes)
+    print(f"Таблица до {args.limit} записана в {args.output} ({size} байт) за {time.time() - start:.2f} с")
+
+if __name__ == "__main__":
+    main()
@@ -3,13 +3,42 @@ import requests
 import json
 import time
 import hashlib
+import os
+import tempfile
+import asyncio
+import threading
+import tracemalloc
+import cProfile
+from unittest import mock
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from sundaram_sieve import resheto_sundarama, resheto_sundarama_naive, resheto_sundarama_segmented, \
+    resheto_sundarama_parallel, resheto_sundarama_range, count_primes, PrimeTable, SundaramSieve, sieve_primes, \
+    table_limit, table_memory
+from sundaram_table import build_table, PrimeTableFile
+from sundaram_codec import PRIMES_MEDIA_TYPE, PAYLOAD_JSON_TAIL, encode_primes_payload, decode_primes_payload, \
+    encode_payload_head, encode_primes_slice
+from sundaram_results import encode_result
+from sundaram_storage import JsonStorage, SqliteStorage, WriteBehindStorage, AlreadyExists, history_entry
+from sundaram_executor import Executors, Overloaded, SingleFlight
+from sundaram_jobs import JobManager, TooManyJobs, JobTooLarge, QUEUED, RUNNING
+from sundaram_metrics import Registry
+from sundaram_profile import RequestProfile
+from sundaram_bench import run_suite, compare
+from sundaram_load import percentile, parse_weights
+from sundaram_models import User
+from sundaram_migrate import migrate
+from sundaram_client import Client, AsyncClient
+from fastapi import HTTPException
+import sundaram_server
 
 class TestSundaramEndpoints(unittest.TestCase):
     
     def setUp(self):
         self.base_url = "http://localhost:8000"
-        self.username = f"testuser_{int(time.time())}"
-        self.email = f"test_{int(time.time())}@test.com"
+        self.username = f"testuser_{time.time_ns()}"
+        self.email = f"test_{time.time_ns()}@test.com"
         self.password = "Test123!@#"
         self.token = None
     
@@ -278,5 +307,953 @@ class TestSundaramEndpoints(unittest.TestCase):
         print(f"    Итог: {response.status_code}")
         self.assertEqual(response.status_code, 401)
 
+    def test_18_primes_range(self):
+        requests.post(f"{self.base_url}/users/register", 
+                     json={"login": self.username, "email": self.email, "password": self.password})
+        self.auth_user()
+        
+        signature = self.get_signature()
+        headers = {"Authorization": signature}
+        response = requests.get(f"{self.base_url}/sundaram/range?lo=90&hi=130", headers=headers)
+        
+        print(f"\n18. Простые числа в диапазоне [90, 130]:")
+        print(f"    Ожидаемый код: 200")
+        print(f"    Итог: {response.status_code}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["primes"], [97, 101, 103, 107, 109, 113, 127])
+    
+    def test_19_primes_count(self):
+        requests.post(f"{self.base_url}/users/register", 
+                     json={"login": self.username, "email": self.email, "password": self.password})
+        self.auth_user()
+        
+        signature = self.get_signature()
+        headers = {"Authorization": signature}
+        response = requests.get(f"{self.base_url}/sundaram/count?limit=1000", headers=headers)
+        
+        print(f"\n19. Количество простых чисел до 1000:")
+        print(f"    Ожидаемый код: 200")
+        print(f"    Итог: {response.status_code}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["count"], 168)
+
+    def test_20_generate_stream(self):
+        requests.post(f"{self.base_url}/users/register", 
+                     json={"login": self.username, "email": self.email, "password": self.password})
+        self.auth_user()
+        
+        data = {"limit": 100}
+        signature = self.get_signature(data)
+        headers = {"Authorization": signature, "Accept": "application/x-ndjson"}
+        response = requests.post(f"{self.base_url}/sundaram/generate", json=data, headers=headers, stream=True)
+        records = [json.loads(line) for line in response.iter_lines() if line]
+        
+        print(f"\n20. Потоковая генерация простых чисел до 100:")
+        print(f"    Ожидаемый код: 200")
+        print(f"    Итог: {response.status_code}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sum(len(r["primes"]) for r in records[:-1]), 25)
+        self.assertEqual(records[-1]["count"], 25)
+
+    def test_21_generate_binary(self):
+        requests.post(f"{self.base_url}/users/register", 
+                     json={"login": self.username, "email": self.email, "password": self.password})
+        self.auth_user()
+        
+        data = {"limit": 1000}
+        signature = self.get_signature(data)
+        headers = {"Authorization": signature, "Accept": PRIMES_MEDIA_TYPE}
+        response = requests.post(f"{self.base_url}/sundaram/generate", json=data, headers=headers)
+        
+        print(f"\n21. Генерация простых чисел до 1000 в бинарном формате:")
+        print(f"    Ожидаемый код: 200")
+        print(f"    Итог: {response.status_code}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["Content-Type"], PRIMES_MEDIA_TYPE)
+        result = decode_primes_payload(response.content)
+        self.assertEqual(result["primes"], resheto_sundarama(1000))
+        self.assertEqual(result["count"], 168)
+
+    def test_22_current_from_store(self):
+        requests.post(f"{self.base_url}/users/register", 
+                     json={"login": self.username, "email": self.email, "password": self.password})
+        self.auth_user()
+        
+        data = {"limit": 500}
+        signature = self.get_signature(data)
+        headers = {"Authorization": signature}
+        requests.post(f"{self.base_url}/sundaram/generate", json=data, headers=headers)
+        
+        signature = self.get_signature()
+        headers = {"Authorization": signature}
+        response = requests.get(f"{self.base_url}/sundaram/current", headers=headers)
+        
+        print(f"\n22. Текущий результат из общего хранилища:")
+        print(f"    Ожидаемый код: 200")
+        print(f"    Итог: {response.status_code}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["primes"], resheto_sundarama(500))
+        self.assertEqual(response.json()["params"], {"limit": 500, "count": 95})
+
+    def test_23_signature_headers(self):
+        response = requests.post(f"{self.base_url}/users/register", 
+                                 json={"login": self.username, "email": self.email, "password": self.password})
+        user_id = response.json()["user_id"]
+        self.auth_user()
+        
+        current_time = str(int(time.time()))
+        signature = hashlib.sha256(f"{self.token}{{}}{current_time}".encode()).hexdigest()
+        headers = {"Authorization": signature, "X-User-Id": str(user_id), "X-Timestamp": current_time}
+        response = requests.get(f"{self.base_url}/sundaram/saved_params", headers=headers)
+        
+        print(f"\n23. Проверка подписи по id пользователя и времени:")
+        print(f"    Ожидаемый код: 200")
+        print(f"    Итог: {response.status_code}")
+        self.assertEqual(response.status_code, 200)
+        
+        headers["X-Timestamp"] = str(int(current_time) - 60)
+        response = requests.get(f"{self.base_url}/sundaram/saved_params", headers=headers)
+        self.assertEqual(response.status_code, 401)
+
+    def test_24_history_pages(self):
+        requests.post(f"{self.base_url}/users/register", 
+                     json={"login": self.username, "email": self.email, "password": self.password})
+        self.auth_user()
+        
+        signature = self.get_signature()
+        headers = {"Authorization": signature}
+        response = requests.get(f"{self.base_url}/users/history?limit=1", headers=headers)
+        
+        print(f"\n24. Постраничное получение истории:")
+        print(f"    Ожидаемый код: 200")
+        print(f"    Итог: {response.status_code}")
+        self.assertEqual(response.status_code, 200)
+        first_page = response.json()
+        self.assertEqual([h["operation"] for h in first_page["history"]], ["register"])
+        
+        signature = self.get_signature()
+        headers = {"Authorization": signature}
+        response = requests.get(f"{self.base_url}/users/history?limit=1&cursor={first_page['next_cursor']}",
+                                headers=headers)
+        self.assertEqual([h["operation"] for h in response.json()["history"]], ["auth"])
+
+    def test_25_job(self):
+        requests.post(f"{self.base_url}/users/register", 
+                     json={"login": self.username, "email": self.email, "password": self.password})
+        self.auth_user()
+        
+        data = {"limit": 100000}
+        signature = self.get_signature(data)
+        headers = {"Authorization": signature}
+        response = requests.post(f"{self.base_url}/sundaram/jobs", json=data, headers=headers)
+        
+        print(f"\n25. Фоновая задача генерации:")
+        print(f"    Ожидаемый код: 202")
+        print(f"    Итог: {response.status_code}")
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()["job_id"]
+        
+        for _ in range(100):
+            headers = {"Authorization": self.get_signature()}
+            status = requests.get(f"{self.base_url}/sundaram/jobs/{job_id}", headers=headers).json()
+            if status["status"] == "done":
+                break
+            time.sleep(0.1)
+        self.assertEqual((status["status"], status["progress"], status["count"]), ("done", 1.0, 9592))
+        
+        headers = {"Authorization": self.get_signature()}
+        response = requests.get(f"{self.base_url}/sundaram/jobs/{job_id}/result", headers=headers)
+        self.assertEqual(response.json()["primes"], resheto_sundarama(100000))
+        
+        headers = {"Authorization": self.get_signature()}
+        response = requests.delete(f"{self.base_url}/sundaram/jobs/{job_id}", headers=headers)
+        self.assertEqual(response.status_code, 409)
+        
+        headers = {"Authorization": self.get_signature()}
+        response = requests.get(f"{self.base_url}/sundaram/jobs/unknown", headers=headers)
+        self.assertEqual(response.status_code, 404)
+        
+        # результат до 10^11 не помещается в память задач: отказ сразу, а не рост до нехватки памяти
+        data = {"limit": 10 ** 11}
+        headers = {"Authorization": self.get_signature(data)}
+        response = requests.post(f"{self.base_url}/sundaram/jobs", json=data, headers=headers)
+        self.assertEqual(response.status_code, 413)
+
+    def test_26_metrics(self):
+        requests.post(f"{self.base_url}/users/register", 
+                     json={"login": self.username, "email": self.email, "password": self.password})
+        response = requests.get(f"{self.base_url}/metrics")
+        
+        print(f"\n26. Метрики сервера:")
+        print(f"    Ожидаемый код: 200")
+        print(f"    Итог: {response.status_code}")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["Content-Type"].startswith("text/plain"))
+        self.assertIn('sundaram_http_requests_total{route="/users/register",method="POST",status="200"}', response.text)
+        self.assertIn('sundaram_stage_duration_seconds_count{stage="save_history"}', response.text)
+        self.assertIn('sundaram_prime_table{value="limit"}', response.text)
+
+    def test_27_client_session(self):
+        with Client(self.base_url) as client:
+            client.session_token = None
+            response = client.request('POST', "/users/register",
+                                      json={"login": self.username, "email": self.email, "password": self.password})
+            client.login(response.json())
+            results = [client.send_request('GET', "/sundaram/count?limit=1000") for _ in range(5)]
+            # все запросы прошли через одно keep-alive соединение
+            pools = client.session.get_adapter(self.base_url).poolmanager.pools
+            connections = sum(pools[key].num_connections for key in pools.keys())
+        
+        print(f"\n27. Клиент с пулом соединений:")
+        print(f"    Ожидаемые коды: 200")
+        print(f"    Итог: {[code for _, code in results]}")
+        self.assertEqual([code for _, code in results], [200] * 5)
+        self.assertEqual(json.loads(results[0][0])["count"], 168)
+        self.assertEqual(connections, 1)
+    
+    def test_28_async_client(self):
+        async def run():
+            async with AsyncClient(self.base_url, concurrency=4) as client:
+                await client.register(self.username, self.email, self.password)
+                return await client.generate_many([10, 100, 1000, 100, 10], concurrency=4)
+        
+        results = asyncio.run(run())
+        
+        print(f"\n28. Асинхронная пакетная генерация:")
+        print(f"    Ожидаемые количества: [4, 25, 168, 25, 4]")
+        print(f"    Итог: {[len(result['primes']) for result in results]}")
+        self.assertEqual([result["primes"] for result in results],
+                         [resheto_sundarama(limit) for limit in [10, 100, 1000, 100, 10]])
+
+    def test_29_light_requests_during_sieve(self):
+        response = requests.post(f"{self.base_url}/users/register", 
+                                 json={"login": self.username, "email": self.email, "password": self.password})
+        user_id = str(response.json()["user_id"])
+        self.auth_user()
+        
+        def headers(body=None):
+            current_time = str(int(time.time()))
+            signature = hashlib.sha256(f"{self.token}{json.dumps(body) if body else '{}'}{current_time}".encode()).hexdigest()
+            return {"Authorization": signature, "X-User-Id": user_id, "X-Timestamp": current_time}
+        
+        # большой ответ кодируется кусками: легкие запросы не ждут сериализации всего списка под GIL
+        data = {"limit": 10 ** 8}
+        with ThreadPoolExecutor(1) as pool:
+            generate = pool.submit(requests.post, f"{self.base_url}/sundaram/generate", json=data, headers=headers(data))
+            latencies = []
+            while not generate.done():
+                start = time.time()
+                self.assertEqual(requests.get(f"{self.base_url}/sundaram/saved_params", headers=headers()).status_code, 200)
+                # метрики не ждут очереди процесса решета
+                self.assertEqual(requests.get(f"{self.base_url}/metrics").status_code, 200)
+                latencies.append(time.time() - start)
+                time.sleep(0.02)
+            result = generate.result().json()
+        
+        print(f"\n29. Легкие запросы и метрики во время решета до 10^8:")
+        print(f"    Ожидаемая задержка: < 0.3 с")
+        print(f"    Итог: {max(latencies):.3f} с")
+        self.assertEqual((result["count"], result["primes"][-1]), (5761455, 99999989))
+        self.assertLess(max(latencies), 0.3)
+    
+    def test_30_result_too_large(self):
+        requests.post(f"{self.base_url}/users/register", 
+                     json={"login": self.username, "email": self.email, "password": self.password})
+        self.auth_user()
+        
+        # результат выше SUNDARAM_RESPONSE_MAX_BYTES не собирается в память целиком - только поток или задача
+        data = {"limit": 10 ** 12}
+        response = requests.post(f"{self.base_url}/sundaram/generate", json=data,
+                                 headers={"Authorization": self.get_signature(data)})
+        range_response = requests.get(f"{self.base_url}/sundaram/range?lo=0&hi={10 ** 12}",
+                                      headers={"Authorization": self.get_signature()})
+        narrow_response = requests.get(f"{self.base_url}/sundaram/range?lo={10 ** 12}&hi={10 ** 12 + 100}",
+                                       headers={"Authorization": self.get_signature()})
+        
+        print(f"\n30. Генерация до 10^12 без потока:")
+        print(f"    Ожидаемый код: 413")
+        print(f"    Итог: {response.status_code}")
+        self.assertEqual(response.status_code, 413)
+        self.assertIn("application/x-ndjson", response.json()["detail"])
+        self.assertEqual(range_response.status_code, 413)
+        self.assertEqual(narrow_response.status_code, 200)
+        self.assertEqual(narrow_response.json()["primes"], [1000000000039, 1000000000061, 1000000000063, 1000000000091])
+
+class TestSundaramEngines(unittest.TestCase):
+
+    def test_01_same_as_naive(self):
+        for limit in list(range(-2, 300)) + [1000, 4096, 10007, 30000]:
+            self.assertEqual(resheto_sundarama(limit), resheto_sundarama_naive(limit), f"limit={limit}")
+
+    def test_02_python_ints(self):
+        primes = resheto_sundarama(100)
+        self.assertEqual(len(primes), 25)
+        self.assertTrue(all(type(p) is int for p in primes))
+
+    def test_03_segmented(self):
+        for limit in [0, 1, 2, 3, 10, 99, 100, 101, 1000, 10007]:
+            for segment_size in [1, 7, 64, 1000]:
+                self.assertEqual(resheto_sundarama_segmented(limit, segment_size), resheto_sundarama(limit),
+                                 f"limit={limit}, segment_size={segment_size}")
+
+    def test_04_parallel(self):
+        for limit in [1, 2, 100, 10007, 200000]:
+            self.assertEqual(resheto_sundarama_parallel(limit, workers=2, segment_size=997), resheto_sundarama(limit),
+                             f"limit={limit}")
+
+    def test_05_prime_table(self):
+        table = PrimeTable(max_limit=1000)
+        self.assertEqual(table.get(500), resheto_sundarama(500))
+        self.assertEqual(table.get(100), resheto_sundarama(100))
+        self.assertEqual(table.hits, 1)
+        self.assertEqual(table.get(5000), resheto_sundarama(5000))
+        self.assertEqual(table.limit, 1000)
+        self.assertEqual(table.get(1000), resheto_sundarama(1000))
+        self.assertEqual(table.hits, 2)
+
+        table = PrimeTable(max_limit=1000, eviction="bypass")
+        table.get(5000)
+        self.assertEqual(table.limit, 1)
+
+        # таблица не растет выше SIEVE_MEMORY_LIMIT, остаток досеивается окнами
+        table = PrimeTable(memory_limit=1 << 20)
+        self.assertEqual(table.max_limit, table_limit(1 << 20))
+        tracemalloc.start()
+        try:
+            primes = table.get_array(3_000_000)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(len(primes), count_primes(3_000_000))
+        self.assertLessEqual(len(table.primes) * 8, 1 << 20)
+        self.assertLess(peak, 2 * len(primes) * 8 + (4 << 20))
+
+    def test_06_incremental_sieve(self):
+        sieve = SundaramSieve()
+        primes = [2]
+        for limit in [1, 2, 3, 10, 11, 12, 100, 101, 1000, 777, 5000, 100000]:
+            primes.extend(sieve.extend(limit))
+            self.assertEqual(primes, resheto_sundarama(max(limit, sieve.n * 2 + 1, 2)), f"limit={limit}")
+
+        sieve = SundaramSieve(segment_size=997)
+        primes = [2]
+        for limit in [100, 5000, 4999, 100000]:
+            primes.extend(sieve.extend(limit, workers=2))
+            self.assertEqual(primes, resheto_sundarama(max(limit, sieve.n * 2 + 1)), f"limit={limit}")
+
+    def test_07_range_and_count(self):
+        primes = resheto_sundarama(5000)
+        for lo, hi in [(0, 0), (0, 1), (0, 2), (2, 3), (3, 3), (4, 4), (5, 1), (100, 200), (1, 5000), (4000, 5000)]:
+            self.assertEqual(resheto_sundarama_range(lo, hi), [p for p in primes if lo <= p <= hi], f"[{lo}, {hi}]")
+        for limit in [0, 1, 2, 3, 100, 4999, 5000]:
+            self.assertEqual(count_primes(limit, segment_size=97), len(resheto_sundarama(limit)), f"limit={limit}")
+
+    def test_08_table_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "primes.tbl")
+            build_table(path, 300000, block_bytes=64)
+            table = PrimeTableFile(path)
+            for limit in [0, 1, 2, 3, 100, 1023, 1024, 1025, 299999, 300000]:
+                self.assertEqual(table.primes(limit), resheto_sundarama(limit), f"limit={limit}")
+            self.assertRaises(ValueError, table.primes, 300001)
+            for lo, hi in [(0, 0), (0, 2), (2, 2), (3, 3), (4, 4), (1000, 1100), (1017, 2048), (299000, 300000)]:
+                self.assertEqual(table.primes_between(lo, hi), resheto_sundarama_range(lo, hi), f"[{lo}, {hi}]")
+                self.assertEqual(table.primes_array(lo, hi), array('q', resheto_sundarama_range(lo, hi)))
+            for limit in [0, 1, 2, 3, 511, 512, 513, 1024, 5000, 300000]:
+                self.assertEqual(table.count(limit), len(resheto_sundarama(limit)), f"limit={limit}")
+            table.close()
+
+    def test_09_binary_codec(self):
+        for primes in [[], [2], [2, 3, 5], resheto_sundarama(100000), [3, 1 << 20, 1 << 40, (1 << 62) + 1]]:
+            payload = {"message": "Тест", "primes": primes, "limit": 100000}
+            self.assertEqual(decode_primes_payload(encode_primes_payload(payload)), payload)
+            
+            # тот же ответ, закодированный кусками
+            values = array('q', primes)
+            for binary in [True, False]:
+                body = encode_payload_head({**payload, "primes": values}, binary) + b"".join(
+                    encode_primes_slice(values, lo, min(lo + 1000, len(values)), binary)
+                    for lo in range(0, len(values), 1000))
+                if binary:
+                    self.assertEqual(body, encode_primes_payload(payload))
+                else:
+                    self.assertEqual(json.loads(body + PAYLOAD_JSON_TAIL), payload)
+
+    def test_10_executor_backpressure(self):
+        pool = Executors(processes=0, concurrency=1, queue_limit=1)
+        release = threading.Event()
+
+        async def scenario():
+            first = asyncio.ensure_future(pool.run_sieve(release.wait))
+            await asyncio.sleep(0.05)
+            second = asyncio.ensure_future(pool.run_sieve(sieve_primes, 30))
+            await asyncio.sleep(0.05)
+            with self.assertRaises(Overloaded):
+                await pool.run_sieve(sieve_primes, 30)
+            release.set()
+            await first
+            return (await second).tolist()
+
+        try:
+            self.assertEqual(asyncio.run(scenario()), resheto_sundarama(30))
+            self.assertEqual((pool.active, pool.waiting), (0, 0))
+        finally:
+            pool.shutdown()
+
+    def test_11_single_flight(self):
+        flights = SingleFlight()
+        calls = []
+
+        async def compute(limit):
+            calls.append(limit)
+            await asyncio.sleep(0.05)
+            return sieve_primes(limit)
+
+        async def scenario():
+            limits = [1000, 1000, 500, 2, 1000, 999]
+            results = await asyncio.gather(*[flights.run(limit, compute) for limit in limits])
+            return limits, results
+
+        limits, results = asyncio.run(scenario())
+        for limit, primes in zip(limits, results):
+            self.assertEqual(primes.tolist(), resheto_sundarama(limit))
+        self.assertEqual(calls, [1000])
+        self.assertEqual((flights.started, flights.shared, flights.flights), (1, 5, {}))
+        
+        # срезы для ожидающих с меньшим limit копируются через offload (в сервере - в потоке ввода-вывода)
+        offloaded = []
+        
+        async def offload(func, *args):
+            offloaded.append(args[0].stop)
+            return func(*args)
+        
+        flights = SingleFlight(offload)
+        calls.clear()
+        limits, results = asyncio.run(scenario())
+        for limit, primes in zip(limits, results):
+            self.assertEqual(primes.tolist(), resheto_sundarama(limit))
+        self.assertEqual(sorted(offloaded), [1, 95])
+
+    def test_12_metrics_text_format(self):
+        registry = Registry()
+        counter = registry.counter("test_total", "Тест", ("route",))
+        histogram = registry.histogram("test_seconds", "Тест", buckets=(0.1, 1.0))
+        counter.labels('/a"b').inc()
+        counter.labels('/a"b').inc(2)
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value)
+        self.assertEqual(registry.render().splitlines(), [
+            "# HELP test_total Тест", "# TYPE test_total counter", 'test_total{route="/a\\"b"} 3',
+            "# HELP test_seconds Тест", "# TYPE test_seconds histogram",
+            'test_seconds_bucket{le="0.1"} 1', 'test_seconds_bucket{le="1"} 2', 'test_seconds_bucket{le="+Inf"} 3',
+            "test_seconds_sum 5.55", "test_seconds_count 3"])
+
+    def test_13_request_profile(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for mode, suffix in [("pstats", ".pstats"), ("sample", ".collapsed")]:
+                profile = RequestProfile(mode, tmp)
+                profile.start()
+                with ThreadPoolExecutor(1) as pool:
+                    pool.submit(profile.wrap(lambda: [resheto_sundarama(200000) for _ in range(5)])).result()
+                profile.stop()
+                path = profile.save()
+                self.assertEqual(path, os.path.join(tmp, profile.id + suffix))
+                self.assertGreater(os.path.getsize(path), 0)
+            
+            # Python 3.12+: второй cProfile при включенном в цикле событий отклоняется с ValueError
+            class SingleProfile(cProfile.Profile):
+                active = False
+                
+                def enable(self):
+                    if SingleProfile.active:
+                        raise ValueError("Another profiling tool is already active")
+                    SingleProfile.active = True
+                    super().enable()
+                
+                def disable(self):
+                    super().disable()
+                    SingleProfile.active = False
+            
+            with mock.patch("sundaram_profile.cProfile.Profile", SingleProfile):
+                profile = RequestProfile("pstats", tmp)
+                profile.start()
+                with ThreadPoolExecutor(1) as pool:
+                    self.assertEqual(pool.submit(profile.wrap(lambda: sum(range(1000)))).result(), 499500)
+                profile.stop()
+                self.assertEqual(profile.profiles, [])
+                self.assertGreater(os.path.getsize(profile.save()), 0)
+
+    def test_14_bench_compare(self):
+        results = run_suite(["sundaram", "count"], [1000, 10000], repeat=1)
+        self.assertEqual([(r["engine"], r["limit"], r["count"]) for r in results["results"]],
+                         [("sundaram", 1000, 168), ("sundaram", 10000, 1229), ("count", 1000, 168), ("count", 10000, 1229)])
+        
+        slower = json.loads(json.dumps(results))
+        for record in slower["results"]:
+            record["wall_time"] *= 2
+        self.assertFalse(any(row["regression"] for row in compare(results, results, 0.1)))
+        self.assertTrue(all(row["regression"] for row in compare(slower, results, 0.1)))
+
+    def test_15_load_percentiles(self):
+        values = [i / 1000 for i in range(1, 101)]
+        self.assertEqual([percentile(values, p) for p in (50, 95, 99, 100)], [0.05, 0.095, 0.099, 0.1])
+        self.assertEqual(percentile([], 99), 0.0)
+        self.assertEqual(parse_weights("100:40, 10000:60"), {"100": 40.0, "10000": 60.0})
+
+    def test_16_job_limits(self):
+        async def scenario():
+            gate = asyncio.Event()
+            running = []
+            
+            async def run(job):
+                job.status = RUNNING
+                running.append(job.id)
+                await gate.wait()
+                job.add(array('q', range(job.limit)), job.limit)
+            
+            jobs = JobManager(run, per_user=2, max_bytes=8 * 250, concurrency=1, queue_limit=3)
+            first, second = jobs.submit(1, 100), jobs.submit(1, 100)
+            with self.assertRaises(TooManyJobs):
+                jobs.submit(1, 100)
+            third = jobs.submit(2, 100)
+            with self.assertRaises(TooManyJobs):
+                jobs.submit(3, 100)
+            # задачи в своей очереди: считается одна, остальные ждут, не трогая обратное давление generate
+            await asyncio.sleep(0.01)
+            self.assertEqual((len(running), second.status, third.status), (1, QUEUED, QUEUED))
+            gate.set()
+            await asyncio.gather(first.task, second.task, third.task)
+            # результаты трех задач (2400 байт) не помещаются в 2000: удалена самая старая
+            self.assertEqual(sorted(jobs.jobs), sorted([second.id, third.id]))
+            # новая задача пользователя вытесняет его самую старую завершенную
+            fourth = jobs.submit(2, 10)
+            await fourth.task
+            self.assertEqual(sorted(jobs.jobs), sorted([second.id, third.id, fourth.id]))
+            fifth = jobs.submit(2, 10)
+            await fifth.task
+            self.assertEqual(sorted(jobs.jobs), sorted([second.id, fourth.id, fifth.id]))
+            self.assertLessEqual(jobs.retained_bytes(), 8 * 250)
+        
+        asyncio.run(scenario())
+
+    def test_17_legacy_signatures(self):
+        # подпись без X-User-Id: один проход по сессиям, повторного перебора после промаха нет
+        storage = mock.Mock()
+        storage.sessions.return_value = [("token", 1)]
+        request = mock.Mock(headers={"Authorization": "wrong"})
+        with mock.patch.object(sundaram_server, "storage", storage):
+            with self.assertRaises(HTTPException):
+                sundaram_server.get_user_by_token(request)
+            self.assertEqual(storage.sessions.call_count, 1)
+            
+            with mock.patch.object(sundaram_server, "LEGACY_SIGNATURES", False):
+                with self.assertRaises(HTTPException):
+                    sundaram_server.get_user_by_token(request)
+            self.assertEqual(storage.sessions.call_count, 1)
+
+    def test_18_job_size(self):
+        async def scenario():
+            gate = asyncio.Event()
+            
+            async def run(job):
+                await gate.wait()
+                job.add(array('q', resheto_sundarama(job.limit)), job.limit)
+            
+            jobs = JobManager(run, per_user=4, max_bytes=table_memory(10 ** 6))
+            with self.assertRaises(JobTooLarge):
+                jobs.submit(1, 10 ** 7)
+            # место под результат незавершенной задачи зарезервировано по оценке с момента создания
+            first = jobs.submit(1, 10 ** 6)
+            with self.assertRaises(TooManyJobs):
+                jobs.submit(2, 10 ** 6)
+            gate.set()
+            await first.task
+            self.assertEqual(first.count, 78498)
+            # завершенный результат вытесняется ради новой задачи
+            second = jobs.submit(2, 10 ** 6)
+            await second.task
+            self.assertEqual(list(jobs.jobs), [second.id])
+            self.assertLessEqual(jobs.retained_bytes(), jobs.max_bytes)
+        
+        asyncio.run(scenario())
+
+    def test_19_client_retry_signature(self):
+        # повтор после 503 уходит с новой подписью и временем, в том числе POST генерации
+        def response(status):
+            result = requests.Response()
+            result.status_code = status
+            result.headers["Retry-After"] = "0"
+            result._content = b'{"limit": 10, "primes": [2, 3, 5, 7]}'
+            result._content_consumed = True
+            return result
+        
+        session = mock.Mock()
+        session.request.side_effect = [response(503), response(200)]
+        client = Client("http://test", retries=2, session=session)
+        client.login({"session_token": "token", "user_id": 1})
+        clock = iter([1000.0, 1004.0])
+        with mock.patch("sundaram_client.time.time", lambda: next(clock)):
+            result, code = client.send_request('POST', "/sundaram/generate", {"limit": 10})
+        
+        self.assertEqual((code, json.loads(result)["primes"]), (200, [2, 3, 5, 7]))
+        headers = [call.kwargs["headers"] for call in session.request.call_args_list]
+        self.assertEqual([h["X-Timestamp"] for h in headers], ["1000", "1004"])
+        self.assertEqual([h["Authorization"] for h in headers],
+                         [client.create_signature({"limit": 10}, t) for t in ["1000", "1004"]])
+        
+        # 502 для POST не повторяется: запрос мог дойти до сервера
+        session.request.side_effect = [response(502), response(200)]
+        session.request.reset_mock()
+        self.assertEqual(client.send_request('POST', "/sundaram/save_params", {"name": "p"})[1], 502)
+        self.assertEqual(session.request.call_count, 1)
+
+class TestSundaramStorage(unittest.TestCase):
+
+    def check_storage(self, storage):
+        user = User(login="storage_user", email="storage@test.com", password="Test123!@#", session_token="token")
+        storage.create(user)
+        storage.init_history(user.id)
+        self.assertEqual(storage.find_by_login("storage_user").id, user.id)
+        self.assertEqual(storage.find_by_email("storage@test.com").id, user.id)
+        self.assertIsNone(storage.find_by_login("nobody"))
+        for login, email, field in [("storage_user", "other@test.com", "login"), ("other", "storage@test.com", "email")]:
+            with self.assertRaises(AlreadyExists) as error:
+                storage.create(User(login=login, email=email, password="Test123!@#"))
+            self.assertEqual(error.exception.field, field)
+        self.assertIn(("token", user.id), [tuple(item) for item in storage.sessions()])
+        
+        user.session_token = "new_token"
+        user.sundaram_params = {"limit": 10, "count": 4}
+        self.assertTrue(storage.save(user))
+        self.assertEqual(storage.get(user.id).session_token, "new_token")
+        self.assertEqual(storage.get(user.id).sundaram_params, {"limit": 10, "count": 4})
+        self.assertFalse(storage.save(storage.get(user.id)))
+        
+        # устаревшая копия записывает только присвоенные ей поля и не откатывает чужие изменения
+        stale = storage.get(user.id)
+        fresh = storage.get(user.id)
+        fresh.session_token = "fresh_token"
+        fresh.password = "New123!@#"
+        self.assertTrue(storage.save(fresh))
+        stale.sundaram_params = {"limit": 20, "count": 8}
+        self.assertTrue(storage.save(stale))
+        stored = storage.get(user.id)
+        self.assertEqual((stored.session_token, stored.password, stored.sundaram_params),
+                         ("fresh_token", "New123!@#", {"limit": 20, "count": 8}))
+        self.assertEqual(storage.find_by_login("storage_user").session_token, "fresh_token")
+        
+        param = {"name": "p", "limit": 10, "created_at": "2026-01-01 00:00:00"}
+        self.assertEqual(storage.add_saved_param(user.id, param), 1)
+        self.assertIsNone(storage.add_saved_param(user.id, param))
+        self.assertEqual(storage.get(user.id).saved_params, [param])
+        self.assertIsNone(storage.delete_saved_param(user.id, "missing"))
+        self.assertEqual(storage.delete_saved_param(user.id, "p"), 0)
+        
+        storage.append_history(user.id, history_entry(user.id, "test", "Тест"))
+        self.assertEqual([h["operation"] for h in storage.get_history(user.id)[0]], ["test"])
+        storage.clear_history(user.id)
+        self.assertEqual(storage.get_history(user.id), ([], None))
+        
+        for i, day in enumerate(["01", "02", "03", "04", "05"]):
+            storage.append_history(user.id, {"user": user.id, "time": f"2026-01-{day} 12:00:00",
+                                             "operation": f"op{i}", "details": ""})
+        page, cursor = storage.get_history(user.id, limit=2)
+        self.assertEqual([h["operation"] for h in page], ["op0", "op1"])
+        page, cursor = storage.get_history(user.id, cursor=cursor, limit=2)
+        self.assertEqual([h["operation"] for h in page], ["op2", "op3"])
+        page, cursor = storage.get_history(user.id, cursor=cursor, limit=2)
+        self.assertEqual(([h["operation"] for h in page], cursor), (["op4"], None))
+        page, cursor = storage.get_history(user.id, since="2026-01-02 00:00:00", until="2026-01-04 12:00:00")
+        self.assertEqual(([h["operation"] for h in page], cursor), (["op1", "op2", "op3"], None))
+        
+        storage.put_result(30, resheto_sundarama(30))
+        self.assertEqual(storage.get_result(30), array('q', resheto_sundarama(30)))
+        self.assertIsNone(storage.get_result(31))
+
+    def test_01_json_storage(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = JsonStorage(User, tmp)
+            storage.load()
+            self.check_storage(storage)
+            self.assertEqual([name for name in os.listdir(storage.directory) if name.endswith(".tmp")], [])
+
+    def test_02_sqlite_storage(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = SqliteStorage(User, os.path.join(tmp, "sundaram.db"))
+            storage.load()
+            self.check_storage(storage)
+
+    def test_03_write_behind_storage(self):
+        for backend in ["json", "sqlite"]:
+            with tempfile.TemporaryDirectory() as tmp:
+                if backend == "json":
+                    inner = JsonStorage(User, tmp)
+                else:
+                    inner = SqliteStorage(User, os.path.join(tmp, "sundaram.db"))
+                inner.load()
+                storage = WriteBehindStorage(inner, interval=60)
+                storage.start()
+                self.check_storage(storage)
+                
+                # до сброса очереди изменения видны через обертку, а на диске их еще нет
+                user = storage.find_by_login("storage_user")
+                user.session_token = "queued"
+                storage.save(user)
+                storage.append_history(user.id, history_entry(user.id, "queued", ""))
+                self.assertEqual(storage.get(user.id).session_token, "queued")
+                self.assertIn(("queued", user.id), [tuple(item) for item in storage.sessions()])
+                self.assertEqual(len(inner.get_history(user.id)[0]), 5)
+                # обновление индекса (неверная подпись) не сбрасывает очередь
+                storage.refresh(force=True)
+                self.assertEqual(len(inner.get_history(user.id)[0]), 5)
+                self.assertEqual(storage.get(user.id).session_token, "queued")
+                
+                storage.close()
+                stored = inner.reload(user.id)
+                self.assertEqual((stored.session_token, stored.password, stored.sundaram_params),
+                                 ("queued", "New123!@#", {"limit": 20, "count": 8}))
+                self.assertEqual(inner.get_history(user.id)[0][-1]["operation"], "queued")
+                inner.close()
+
+    def test_04_concurrent_create(self):
+        # одновременные регистрации с одним логином: ровно одна успешна, в каталоге один файл
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = JsonStorage(User, tmp)
+            storage.load()
+            barrier = threading.Barrier(8)
+            
+            def register(i):
+                barrier.wait()
+                try:
+                    storage.create(User(login="dup", email=f"dup{i}@test.com", password="Test123!@#"))
+                    return "ok"
+                except AlreadyExists as e:
+                    return e.field
+            
+            with ThreadPoolExecutor(8) as pool:
+                results = list(pool.map(register, range(8)))
+            self.assertEqual(sorted(results), ["login"] * 7 + ["ok"])
+            self.assertEqual(len(os.listdir(storage.directory)), 1)
+            
+            with self.assertRaises(AlreadyExists) as error:
+                storage.create(User(login="other", email=storage.find_by_login("dup").email, password="Test123!@#"))
+            self.assertEqual(error.exception.field, "email")
+
+    def test_05_reads_during_fsync(self):
+        # пока групповая запись ждет fsync, поиск пользователей и чтение истории не блокируются
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = JsonStorage(User, tmp)
+            storage.load()
+            user = User(login="fsync", email="fsync@test.com", password="Test123!@#", session_token="token")
+            storage.create(user)
+            storage.init_history(user.id)
+            user = storage.get(user.id)
+            user.session_token = "batch"
+            storage.remember(user)
+            
+            in_fsync = threading.Event()
+            release = threading.Event()
+            
+            def slow_fsync(fd):
+                in_fsync.set()
+                release.wait(5)
+            
+            with mock.patch("sundaram_storage.os.fsync", slow_fsync):
+                writer = threading.Thread(target=storage.write_batch,
+                                          args=([user], [(user.id, history_entry(user.id, "batch", ""))]))
+                writer.start()
+                self.assertTrue(in_fsync.wait(5))
+                with ThreadPoolExecutor(1) as pool:
+                    reads = pool.submit(lambda: (storage.get(user.id).session_token, storage.sessions(),
+                                                 storage.find_by_login("fsync").id, storage.get_history(user.id)))
+                    session_token, sessions, found_id, history = reads.result(timeout=2)
+                release.set()
+                writer.join()
+            self.assertEqual((session_token, sessions, found_id), ("batch", [("batch", user.id)], user.id))
+            self.assertEqual(storage.reload(user.id).session_token, "batch")
+            self.assertEqual([h["operation"] for h in storage.get_history(user.id)[0]], ["batch"])
+
+    def test_06_results_bounded(self):
+        # результаты занимают не больше max_bytes: вытесняется тот, что дольше всех не читался
+        primes = resheto_sundarama(1000)
+        size = len(encode_result(primes))
+        with tempfile.TemporaryDirectory() as tmp:
+            json_storage = JsonStorage(User, tmp)
+            json_storage.load()
+            json_storage.results.max_bytes = 2 * size
+            sqlite_storage = SqliteStorage(User, os.path.join(tmp, "sundaram.db"))
+            sqlite_storage.load()
+            sqlite_storage.results_max_bytes = 2 * size
+            
+            for storage in [json_storage, sqlite_storage]:
+                storage.put_result(1000, primes)
+                time.sleep(0.05)
+                storage.put_result(1001, primes)
+                time.sleep(0.05)
+                self.assertEqual(storage.get_result(1000), array('q', primes))
+                time.sleep(0.05)
+                storage.put_result(1002, primes)
+                self.assertIsNone(storage.get_result(1001))
+                self.assertEqual(storage.get_result(1000), array('q', primes))
+                self.assertEqual(storage.get_result(1002), array('q', primes))
+                
+                storage.put_result(100000, resheto_sundarama(100000))
+                self.assertIsNone(storage.get_result(100000))
+                self.assertEqual(storage.get_result(1002), array('q', primes))
+
+    def test_07_migrate_read_only(self):
+        # перенос в SQLite не меняет JSON-файлы: старая история остается history_<id>.json
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = os.path.join(tmp, "data")
+            source = JsonStorage(User, data_dir)
+            source.load()
+            user = User(login="migrate", email="migrate@test.com", password="Test123!@#", session_token="token")
+            source.create(user)
+            entries = [history_entry(user.id, "register", ""), history_entry(user.id, "auth", "")]
+            with open(source.legacy_history_path(user.id), 'w') as f:
+                json.dump(entries, f)
+            source.put_result(1000, resheto_sundarama(1000))
+            
+            def snapshot():
+                files = {}
+                for root, _, names in os.walk(data_dir):
+                    for name in names:
+                        path = os.path.join(root, name)
+                        with open(path, 'rb') as f:
+                            files[path] = (f.read(), os.stat(path).st_mtime_ns)
+                return files
+            
+            before = snapshot()
+            stats = migrate(data_dir, os.path.join(tmp, "sundaram.db"))
+            self.assertEqual(snapshot(), before)
+            self.assertEqual((stats["users"], stats["history"], stats["results"]), (1, 2, 1))
+            
+            target = SqliteStorage(User, os.path.join(tmp, "sundaram.db"))
+            self.assertEqual(target.get_history(user.id)[0], entries)
+            self.assertEqual(target.get_result(1000), array('q', resheto_sundarama(1000)))
+
+    def test_08_write_behind_requests(self):
+        # история и сохраненные параметры не вызывают сброс очереди: записи очереди видны сразу,
+        # а записи, которые пишутся в этот момент, не теряются и не повторяются
+        for backend in ["json", "sqlite"]:
+            with tempfile.TemporaryDirectory() as tmp:
+                if backend == "json":
+                    inner = JsonStorage(User, tmp)
+                else:
+                    inner = SqliteStorage(User, os.path.join(tmp, "sundaram.db"))
+                inner.load()
+                storage = WriteBehindStorage(inner, interval=60)
+                storage.start()
+                user = User(login="queued", email="queued@test.com", password="Test123!@#")
+                storage.create(user)
+                storage.init_history(user.id)
+                param = {"name": "p", "limit": 10, "created_at": "2026-01-01 00:00:00"}
+                
+                with mock.patch.object(inner, "write_batch") as write_batch:
+                    for i in range(3):
+                        storage.append_history(user.id, history_entry(user.id, f"op{i}", ""))
+                    self.assertEqual([h["operation"] for h in storage.get_history(user.id, limit=10)[0]],
+                                     ["op0", "op1", "op2"])
+                    self.assertEqual(storage.add_saved_param(user.id, param), 1)
+                    self.assertIsNone(storage.add_saved_param(user.id, param))
+                    self.assertEqual(storage.get(user.id).saved_params, [param])
+                    self.assertEqual(storage.delete_saved_param(user.id, "p"), 0)
+                    self.assertEqual(storage.add_saved_param(user.id, dict(param, name="q")), 1)
+                    storage.clear_history(user.id)
+                    self.assertEqual(storage.get_history(user.id), ([], None))
+                    write_batch.assert_not_called()
+                
+                storage.append_history(user.id, history_entry(user.id, "batch", ""))
+                writing = threading.Event()
+                release = threading.Event()
+                write = inner.write_batch
+                
+                def slow_write(users, history):
+                    writing.set()
+                    release.wait(5)
+                    write(users, history)
+                
+                with mock.patch.object(inner, "write_batch", slow_write):
+                    flusher = threading.Thread(target=storage.flush)
+                    flusher.start()
+                    self.assertTrue(writing.wait(5))
+                    with ThreadPoolExecutor(1) as pool:
+                        read = pool.submit(storage.get_history, user.id)
+                        time.sleep(0.1)
+                        release.set()
+                        history, cursor = read.result(timeout=5)
+                    flusher.join()
+                self.assertEqual(([h["operation"] for h in history], cursor), (["batch"], None))
+                
+                storage.close()
+                self.assertEqual([p["name"] for p in inner.reload(user.id).saved_params], ["q"])
+                self.assertEqual([h["operation"] for h in inner.get_history(user.id)[0]], ["batch"])
+                inner.close()
+
+    def test_09_refresh_without_lock(self):
+        # обход каталога пользователей не держит блокировку репозитория: чтения идут, пока он ждет диск;
+        # файл, записанный другим процессом, подхватывается, а не записанная еще версия из памяти - нет
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = JsonStorage(User, tmp)
+            storage.load()
+            user = User(login="scan", email="scan@test.com", password="Test123!@#", session_token="token")
+            storage.create(user)
+            other = JsonStorage(User, tmp)
+            other.load()
+            other.create(User(login="other_process", email="other@test.com", password="Test123!@#"))
+            
+            in_scan = threading.Event()
+            release = threading.Event()
+            scandir = os.scandir
+            
+            def slow_scandir(path):
+                in_scan.set()
+                release.wait(5)
+                return scandir(path)
+            
+            with mock.patch("sundaram_storage.os.scandir", slow_scandir):
+                scanner = threading.Thread(target=storage.refresh, kwargs={"force": True})
+                scanner.start()
+                self.assertTrue(in_scan.wait(5))
+                with ThreadPoolExecutor(1) as pool:
+                    reads = pool.submit(lambda: (storage.get(user.id).login, storage.sessions()))
+                    self.assertEqual(reads.result(timeout=2), ("scan", [("token", user.id)]))
+                release.set()
+                scanner.join()
+            self.assertEqual(storage.find_by_login("other_process").email, "other@test.com")
+            
+            pending = storage.get(user.id)
+            pending.session_token = "pending"
+            storage.remember(pending)
+            os.utime(storage.path(user.id), ns=(0, 0))
+            storage.refresh(force=True)
+            self.assertEqual(storage.get(user.id).session_token, "pending")
+
+    def test_10_fsync_before_replace(self):
+        # каждая замена файла пользователя или результата - после fsync временного файла
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = JsonStorage(User, tmp)
+            storage.load()
+            calls = []
+            fsync = os.fsync
+            replace = os.replace
+            
+            def record_fsync(fd):
+                calls.append("fsync")
+                fsync(fd)
+            
+            def record_replace(src, dst):
+                calls.append("replace")
+                replace(src, dst)
+            
+            with mock.patch("sundaram_storage.os.fsync", record_fsync), \
+                    mock.patch("sundaram_storage.os.replace", record_replace):
+                user = User(login="durable", email="durable@test.com", password="Test123!@#")
+                storage.create(user)
+                storage.add_saved_param(user.id, {"name": "p", "limit": 10, "created_at": "2026-01-01 00:00:00"})
+                storage.delete_saved_param(user.id, "p")
+                storage.put_result(1000, resheto_sundarama(1000))
+            self.assertEqual(calls, ["fsync", "replace"] * 4)
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file